@@ -5,9 +5,25 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     NATS_URL: str = Field("nats://nats.resto-app.pl:4222", env="NATS_URL")
     NATS_CLIENT_NAME: str = Field("nats-gateway", env="NATS_CLIENT_NAME")
+    NATS_PENDING_MSGS_LIMIT: int = Field(65536, env="NATS_PENDING_MSGS_LIMIT")
+    NATS_PENDING_BYTES_LIMIT: int = Field(64 * 1024 * 1024, env="NATS_PENDING_BYTES_LIMIT")
+    # JSON, e.g. {"device_communication.*.event.>": {"msgs": 1000, "bytes": 1048576}}
+    NATS_SUBJECT_PENDING_LIMITS: dict[str, dict[str, int]] = Field(
+        {},
+        env="NATS_SUBJECT_PENDING_LIMITS",
+    )
+    # JSON list of subject patterns delivered latest-only under load.
+    NATS_CONFLATE_SUBJECTS: list[str] = Field([], env="NATS_CONFLATE_SUBJECTS")
+    NATS_SLOW_CONSUMER_LOG_INTERVAL_SEC: float = Field(
+        5.0,
+        env="NATS_SLOW_CONSUMER_LOG_INTERVAL_SEC",
+    )
 
     WS_HOST: str = Field("0.0.0.0", env="WS_HOST")
     WS_PORT: int = Field(8765, env="WS_PORT")
+    WS_CONTROL_CONCURRENCY: int = Field(8, env="WS_CONTROL_CONCURRENCY")
+    WS_BROADCAST_FANOUT_THRESHOLD: int = Field(64, env="WS_BROADCAST_FANOUT_THRESHOLD")
+    WS_BROADCAST_HIGH_WATER: int = Field(256 * 1024, env="WS_BROADCAST_HIGH_WATER")
 
     LOG_DIR: str = Field("logs", env="LOG_DIR")
     LOG_LEVEL: str = Field("INFO", env="LOG_LEVEL")
@@ -16,6 +32,25 @@ class Settings(BaseSettings):
         "microcontroller_heartbeat",
         env="HEARTBEAT_EVENT_NAME",
     )
+    HEARTBEAT_DEFAULT_INTERVAL_SEC: float = Field(5.0, env="HEARTBEAT_DEFAULT_INTERVAL_SEC")
+    HEARTBEAT_MIN_INTERVAL_SEC: float = Field(1.0, env="HEARTBEAT_MIN_INTERVAL_SEC")
+    HEARTBEAT_MAX_INTERVAL_SEC: float = Field(300.0, env="HEARTBEAT_MAX_INTERVAL_SEC")
+
+    CLUSTER_ENABLED: bool = Field(False, env="CLUSTER_ENABLED")
+    CLUSTER_NODE_ID: str = Field("", env="CLUSTER_NODE_ID")
+    CLUSTER_SUBJECT_PREFIX: str = Field("gateway.cluster", env="CLUSTER_SUBJECT_PREFIX")
+    CLUSTER_REFRESH_SEC: float = Field(5.0, env="CLUSTER_REFRESH_SEC")
+    CLUSTER_LEASE_TTL_SEC: float = Field(15.0, env="CLUSTER_LEASE_TTL_SEC")
+    CLUSTER_SETTLE_SEC: float = Field(1.0, env="CLUSTER_SETTLE_SEC")
+
+    TRACE_TIMESTAMP_HEADER: str = Field("Nats-Time-Stamp", env="TRACE_TIMESTAMP_HEADER")
+
+    ADMIN_ENABLED: bool = Field(False, env="ADMIN_ENABLED")
+    ADMIN_PATH_PREFIX: str = Field("/admin", env="ADMIN_PATH_PREFIX")
+    ADMIN_TOKEN: str = Field("", env="ADMIN_TOKEN")
+    ADMIN_PAGE_SIZE: int = Field(50, env="ADMIN_PAGE_SIZE")
+    ADMIN_MAX_PAGE_SIZE: int = Field(500, env="ADMIN_MAX_PAGE_SIZE")
+    ADMIN_RATE_WINDOW_SEC: float = Field(10.0, env="ADMIN_RATE_WINDOW_SEC")
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -1,16 +1,23 @@
 import asyncio
-import base64
 import json
+import math
 import signal
+import time
+from datetime import datetime
 
 import nats
 import websockets
+from nats.errors import SlowConsumerError
 
 from app.core.config import settings
 from app.core.logging import logger
+from app.nats.cluster import HeartbeatCluster
 from app.nats.publisher import set_nats_client
 from app.nats.subscription_manager import NatsSubscriptionManager
-from app.ws.send import send_to_subscribers
+from app.ws.admin import build_admin_request_handler
+from app.ws.heartbeat import set_heartbeat_cluster
+from app.ws.send import send_binary_to_subscribers, send_to_subscribers
+from app.ws.subscriptions import has_traced_subscribers
 from app.ws.websocket_handler import websocket_handler
 
 
@@ -18,13 +25,8 @@ def _decode_nats_payload(raw_data: bytes) -> tuple[object, str]:
     try:
         text = raw_data.decode("utf-8")
     except UnicodeDecodeError:
-        return (
-            {
-                "encoding": "base64",
-                "value": base64.b64encode(raw_data).decode("ascii"),
-            },
-            "binary",
-        )
+        # Left undecoded: binary payloads are framed per subscriber in send.py
+        return None, "binary"
 
     try:
         return json.loads(text), "json"
@@ -32,36 +34,104 @@ def _decode_nats_payload(raw_data: bytes) -> tuple[object, str]:
         return text, "text"
 
 
+def _nats_header_timestamp(msg) -> float | None:
+    """
+    Publisher timestamp from TRACE_TIMESTAMP_HEADER as epoch milliseconds.
+    Accepts epoch seconds/milliseconds or an ISO 8601 / RFC 3339 string.
+    """
+    headers = getattr(msg, "headers", None)
+    if not headers:
+        return None
+
+    raw = headers.get(settings.TRACE_TIMESTAMP_HEADER)
+    if not raw:
+        return None
+
+    try:
+        value = float(raw)
+    except ValueError:
+        pass
+    else:
+        if not math.isfinite(value):
+            return None
+        # Anything this large is already milliseconds (or finer).
+        while value > 1e14:
+            value /= 1000
+        return value if value > 1e11 else value * 1000
+
+    try:
+        # fromisoformat keeps at most microseconds, RFC 3339 may carry nanoseconds.
+        head, dot, tail = raw.partition(".")
+        if dot:
+            digits = len(tail) - len(tail.lstrip("0123456789"))
+            tail = tail[:min(digits, 6)] + tail[digits:]
+            raw = f"{head}.{tail}"
+        return datetime.fromisoformat(raw).timestamp() * 1000
+    except ValueError:
+        return None
+
+
+async def on_nats_msg(msg):
+    subject = msg.subject
+    try:
+        # Stamps are only built while someone opted into tracing this subject.
+        trace = None
+        if has_traced_subscribers(subject):
+            trace = {"gw_recv": round(time.time() * 1000, 3)}
+            nats_ts = _nats_header_timestamp(msg)
+            if nats_ts is not None:
+                trace["nats_ts"] = round(nats_ts, 3)
+
+        payload, payload_format = _decode_nats_payload(msg.data)
+        if payload_format != "json":
+            logger.debug(
+                "Forwarding non-JSON NATS payload subject=%s payload_format=%s",
+                subject,
+                payload_format,
+            )
+        if payload_format == "binary":
+            await send_binary_to_subscribers(subject, msg.data, trace)
+            return
+        await send_to_subscribers(
+            subject,
+            {
+                "subject": subject,
+                "data": payload,
+                "payload_format": payload_format,
+            },
+            trace,
+        )
+    except Exception:
+        logger.exception("NATS message handling failed for subject=%s", subject)
+
+
 async def start_gateway():
     logger.info("Starting NATS -> WebSocket gateway")
 
+    nats_manager: NatsSubscriptionManager | None = None
+
+    async def on_nats_error(e):
+        # nats-py reports every message dropped by a full pending queue here.
+        # e.subject is the message subject; the subscription's subject is the
+        # (possibly wildcard) one the manager tracks.
+        if isinstance(e, SlowConsumerError) and nats_manager is not None:
+            nats_manager.record_slow_consumer(e.sub.subject if e.sub is not None else e.subject)
+            return
+        logger.error("NATS error: %r", e)
+
     nc = await nats.connect(
         settings.NATS_URL,
         name=settings.NATS_CLIENT_NAME,
+        error_cb=on_nats_error,
     )
     logger.info("Connected to NATS Core: %s", settings.NATS_URL)
     set_nats_client(nc)
 
-    async def on_nats_msg(msg):
-        subject = msg.subject
-        try:
-            payload, payload_format = _decode_nats_payload(msg.data)
-            if payload_format != "json":
-                logger.debug(
-                    "Forwarding non-JSON NATS payload subject=%s payload_format=%s",
-                    subject,
-                    payload_format,
-                )
-            await send_to_subscribers(
-                subject,
-                {
-                    "subject": subject,
-                    "data": payload,
-                    "payload_format": payload_format,
-                },
-            )
-        except Exception:
-            logger.exception("NATS message handling failed for subject=%s", subject)
+    cluster = None
+    if settings.CLUSTER_ENABLED:
+        cluster = HeartbeatCluster(nc)
+        await cluster.start()
+        set_heartbeat_cluster(cluster)
 
     nats_manager = NatsSubscriptionManager(nc, on_nats_msg)
 
@@ -69,6 +139,7 @@ async def start_gateway():
         lambda ws: websocket_handler(ws, nats_manager),
         host=settings.WS_HOST,
         port=settings.WS_PORT,
+        process_request=build_admin_request_handler(nats_manager),
         ping_interval=30,
         ping_timeout=10,
         max_queue=32,
@@ -96,6 +167,12 @@ async def start_gateway():
     ws_server.close()
     await ws_server.wait_closed()
 
+    if cluster is not None:
+        try:
+            await cluster.stop()
+        except Exception:
+            logger.exception("Failed to leave gateway cluster during shutdown")
+
     try:
         await nats_manager.stop_all()
     except Exception:
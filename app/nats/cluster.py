@@ -0,0 +1,413 @@
+"""
+Cluster-wide heartbeat control across gateway replicas.
+
+Every node announces its per-device heartbeat interest (the fastest interval
+its own subscribers want) on CLUSTER_SUBJECT_PREFIX.heartbeat:
+- {"type":"interest","node":..,"ttl":..,"uuid":..,"interval":<sec>|null} on change,
+- {"type":"snapshot","node":..,"ttl":..,"devices":{uuid: interval},
+  "running":[uuid, ..]} every CLUSTER_REFRESH_SEC and in reply to a sync
+  request,
+- {"type":"sync","node":..} when a node starts,
+- {"type":"leave","node":..} on graceful shutdown.
+
+Any message renews the sender's membership lease; interest of a node whose
+lease expired is forgotten. Every message also carries "ready", false during
+a node's CLUSTER_SETTLE_SEC start-up window, and "acting". Each device is owned by exactly
+one live ready member, picked by rendezvous hashing over that member set,
+and only the owner sends START/RELOAD/STOP based on the cluster-wide
+aggregate (fastest interval any node wants). Ownership moves with
+membership, a new owner adopts a running device with RELOAD rather than
+START. Nodes know a device is running from their own commands, from an
+acting owner's responsibility for it and from the "running" list in peers'
+snapshots.
+
+A node only starts acting as owner one CLUSTER_REFRESH_SEC round after it
+announced itself ready, so nodes that settle in the same window (rolling
+deploys) have seen each other's readiness and agree on owners before any
+of them sends a command.
+
+Session and heartbeat registries are module-level, so full gateway replicas
+need one process each (distinct WS_PORT and CLUSTER_NODE_ID against one NATS
+server, see tests/test_cluster_integration.py). HeartbeatCluster objects with
+distinct node ids can also share a process and a NATS connection, which is
+how tests/test_cluster.py exercises membership changes.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid as uuid_lib
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.nats.publisher import publish_agent_control
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid_lib.uuid4().hex[:8]}"
+
+
+def _rendezvous_score(node_id: str, micro_uuid: str) -> bytes:
+    # Stable across processes, unlike hash().
+    return hashlib.blake2b(f"{node_id}|{micro_uuid}".encode(), digest_size=8).digest()
+
+
+class HeartbeatCluster:
+    def __init__(self, nc, node_id: str | None = None):
+        self._nc = nc
+        self.node_id = node_id or settings.CLUSTER_NODE_ID or default_node_id()
+        self._subject = f"{settings.CLUSTER_SUBJECT_PREFIX}.heartbeat"
+
+        # device uuid -> interval wanted by this node's subscribers
+        self._local: dict[str, float] = {}
+        # node id -> lease expiry (monotonic), self excluded
+        self._members: dict[str, float] = {}
+        # members past their settle period, only they can own devices
+        self._ready_members: set[str] = set()
+        # node id -> {device uuid: interval}
+        self._remote: dict[str, dict[str, float]] = {}
+        # members already sending device commands
+        self._acting_members: set[str] = set()
+        # device uuid -> interval the device is believed to be running at
+        self._running: dict[str, float] = {}
+        # devices this node currently commands
+        self._owned: set[str] = set()
+
+        # announced as owner candidate
+        self._ready = False
+        # sending device commands, one refresh round after _ready
+        self._acting = False
+        # set when a device command failed to publish
+        self._retry = False
+        self._lock = asyncio.Lock()
+        self._sub = None
+        self._task: asyncio.Task | None = None
+
+    # ---------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------
+    async def start(self):
+        self._sub = await self._nc.subscribe(self._subject, cb=self._on_message)
+        await self._announce({"type": "sync"})
+        self._task = asyncio.create_task(self._run())
+        logger.info("[cluster] node %s joined on %s", self.node_id, self._subject)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self._announce({"type": "leave"})
+        except Exception:
+            logger.exception("[cluster] failed to announce leave")
+
+        if self._sub is not None:
+            try:
+                await self._sub.unsubscribe()
+            except Exception:
+                logger.exception("[cluster] failed to unsubscribe %s", self._subject)
+            self._sub = None
+
+        logger.info("[cluster] node %s left", self.node_id)
+
+    async def _run(self):
+        # Failures below are logged and retried on the next round: if this
+        # task died the node would stop renewing its lease and expiring peers
+        # while still believing it owns devices.
+
+        # Give peers a chance to answer the sync request before becoming an
+        # owner candidate.
+        await asyncio.sleep(settings.CLUSTER_SETTLE_SEC)
+        async with self._lock:
+            self._ready = True
+        try:
+            await self._announce_snapshot()
+        except Exception:
+            logger.exception("[cluster] failed to announce readiness")
+
+        # Peers that became ready in the same window see each other now.
+        await asyncio.sleep(settings.CLUSTER_REFRESH_SEC)
+        async with self._lock:
+            self._acting = True
+            self._expire_members()
+            try:
+                await self._reconcile_all()
+            except Exception:
+                logger.exception("[cluster] failed to reconcile after settle")
+        logger.info(
+            "[cluster] node %s acting as owner, members=%s",
+            self.node_id,
+            sorted(self._members),
+        )
+
+        while True:
+            try:
+                await self._announce_snapshot()
+            except Exception:
+                logger.exception("[cluster] failed to announce snapshot")
+
+            await asyncio.sleep(settings.CLUSTER_REFRESH_SEC)
+
+            async with self._lock:
+                expired = self._expire_members()
+                if expired or self._retry:
+                    # A failed publish left devices behind, reconcile them again.
+                    self._retry = False
+                    try:
+                        await self._reconcile_all()
+                    except Exception:
+                        logger.exception("[cluster] failed to reconcile")
+
+    # ---------------------------------------------------------
+    # Local interest (called by app.ws.heartbeat)
+    # ---------------------------------------------------------
+    async def set_local_interest(self, micro_uuid: str, interval: float | None):
+        async with self._lock:
+            if interval is None:
+                if self._local.pop(micro_uuid, None) is None:
+                    return
+            else:
+                if self._local.get(micro_uuid) == interval:
+                    return
+                self._local[micro_uuid] = interval
+
+            await self._announce({"type": "interest", "uuid": micro_uuid, "interval": interval})
+            await self._reconcile(micro_uuid)
+
+    # ---------------------------------------------------------
+    # Introspection
+    # ---------------------------------------------------------
+    def describe(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "ready": self._ready,
+            "acting": self._acting,
+            "members": sorted([self.node_id, *self._members]),
+            "ready_members": sorted(self._ready_members),
+            "local_devices": len(self._local),
+            "owned_devices": len(self._owned),
+        }
+
+    def owner(self, micro_uuid: str) -> str:
+        candidates = [*self._ready_members]
+        if self._ready:
+            candidates.append(self.node_id)
+        if not candidates:
+            return self.node_id
+        return max(
+            candidates,
+            key=lambda node_id: _rendezvous_score(node_id, micro_uuid),
+        )
+
+    def aggregate(self, micro_uuid: str) -> float | None:
+        remote = self._remote_aggregate(micro_uuid)
+        local = self._local.get(micro_uuid)
+        if remote is None or local is None:
+            return local if remote is None else remote
+        return min(remote, local)
+
+    # ---------------------------------------------------------
+    # Protocol
+    # ---------------------------------------------------------
+    async def _announce(self, payload: dict):
+        payload["node"] = self.node_id
+        payload["ttl"] = settings.CLUSTER_LEASE_TTL_SEC
+        payload["ready"] = self._ready
+        payload["acting"] = self._acting
+        await self._nc.publish(self._subject, json.dumps(payload).encode())
+
+    async def _announce_snapshot(self):
+        await self._announce(
+            {"type": "snapshot", "devices": dict(self._local), "running": sorted(self._running)}
+        )
+
+    async def _on_message(self, msg):
+        try:
+            payload = json.loads(msg.data)
+        except (ValueError, UnicodeDecodeError):
+            logger.warning("[cluster] ignored malformed announcement on %s", msg.subject)
+            return
+
+        node_id = payload.get("node")
+        if not isinstance(node_id, str) or node_id == self.node_id:
+            return
+
+        kind = payload.get("type")
+        try:
+            async with self._lock:
+                await self._apply(node_id, kind, payload)
+        except Exception:
+            logger.exception("[cluster] failed to apply %s from node %s", kind, node_id)
+
+    async def _apply(self, node_id: str, kind, payload: dict):
+        if kind == "leave":
+            self._members.pop(node_id, None)
+            self._ready_members.discard(node_id)
+            self._acting_members.discard(node_id)
+            dropped = self._remote.pop(node_id, {})
+            logger.info("[cluster] node %s left, members=%s", node_id, len(self._members) + 1)
+            await self._reconcile_all(extra=dropped)
+            return
+
+        joined = node_id not in self._members
+        became_ready = payload.get("ready") is True and node_id not in self._ready_members
+        if became_ready:
+            self._ready_members.add(node_id)
+        became_acting = payload.get("acting") is True and node_id not in self._acting_members
+        if became_acting:
+            self._acting_members.add(node_id)
+        ttl = payload.get("ttl")
+        if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0:
+            ttl = settings.CLUSTER_LEASE_TTL_SEC
+        self._members[node_id] = time.monotonic() + ttl
+        devices = self._remote.setdefault(node_id, {})
+        if joined:
+            logger.info("[cluster] node %s joined, members=%s", node_id, len(self._members) + 1)
+
+        touched: set[str] = set()
+        if kind == "sync":
+            await self._announce_snapshot()
+        elif kind == "interest":
+            micro_uuid = payload.get("uuid")
+            interval = payload.get("interval")
+            if isinstance(micro_uuid, str):
+                if isinstance(interval, (int, float)) and not isinstance(interval, bool):
+                    devices[micro_uuid] = float(interval)
+                else:
+                    devices.pop(micro_uuid, None)
+                touched.add(micro_uuid)
+        elif kind == "snapshot":
+            announced = payload.get("devices")
+            if isinstance(announced, dict):
+                fresh = {
+                    micro_uuid: float(interval)
+                    for micro_uuid, interval in announced.items()
+                    if isinstance(interval, (int, float)) and not isinstance(interval, bool)
+                }
+                touched = {
+                    micro_uuid
+                    for micro_uuid in devices.keys() | fresh.keys()
+                    if devices.get(micro_uuid) != fresh.get(micro_uuid)
+                }
+                self._remote[node_id] = fresh
+            running = payload.get("running")
+            if isinstance(running, list):
+                self._learn_running(running)
+
+        if became_ready or became_acting:
+            # Owner candidates changed, or an owner started commanding its
+            # devices: ownership or running state may have moved for any device.
+            await self._reconcile_all()
+        else:
+            for micro_uuid in touched:
+                await self._reconcile(micro_uuid)
+
+    def _expire_members(self) -> bool:
+        now = time.monotonic()
+        expired = [node_id for node_id, expires in self._members.items() if expires < now]
+        for node_id in expired:
+            self._members.pop(node_id, None)
+            self._ready_members.discard(node_id)
+            self._acting_members.discard(node_id)
+            self._remote.pop(node_id, None)
+            logger.warning("[cluster] node %s lease expired", node_id)
+        return bool(expired)
+
+    def _remote_devices(self) -> set[str]:
+        return {micro_uuid for devices in self._remote.values() for micro_uuid in devices}
+
+    def _remote_aggregate(self, micro_uuid: str) -> float | None:
+        intervals = [
+            devices[micro_uuid]
+            for devices in self._remote.values()
+            if micro_uuid in devices
+        ]
+        return min(intervals) if intervals else None
+
+    async def _reconcile_all(self, extra=()):
+        devices = self._remote_devices() | self._local.keys() | self._running.keys() | set(extra)
+        for micro_uuid in devices:
+            await self._reconcile(micro_uuid)
+
+    def _learn_running(self, running: list):
+        # Only devices still wanted: a snapshot sent before a STOP must not
+        # resurrect the device.
+        for micro_uuid in running:
+            if not isinstance(micro_uuid, str) or micro_uuid in self._running:
+                continue
+            aggregate = self.aggregate(micro_uuid)
+            if aggregate is not None:
+                self._running[micro_uuid] = aggregate
+
+    async def _reconcile(self, micro_uuid: str):
+        """
+        Bring the device in line with cluster demand if this node owns it.
+        Caller holds self._lock.
+
+        Owner state is only committed once the command went out, so a failed
+        publish leaves the device to be retried by the refresh loop.
+        """
+        aggregate = self.aggregate(micro_uuid)
+        if not self._acting:
+            if aggregate is None:
+                # Learnt from a snapshot and stopped since, by the owner.
+                self._running.pop(micro_uuid, None)
+            return
+
+        previous = self._running.get(micro_uuid)
+        owner = self.owner(micro_uuid)
+
+        if owner != self.node_id:
+            if aggregate is None:
+                # The owner stops it.
+                self._running.pop(micro_uuid, None)
+            elif owner in self._acting_members:
+                # The owner keeps it running at the aggregate.
+                self._running[micro_uuid] = aggregate
+            if micro_uuid in self._owned:
+                self._owned.discard(micro_uuid)
+                logger.info("[cluster] handed off uuid=%s", micro_uuid)
+            return
+
+        if aggregate is None:
+            self._owned.discard(micro_uuid)
+            if previous is None:
+                return
+            action = "STOP_HEARTBEAT"
+        elif previous is None:
+            action = "START_HEARTBEAT"
+        elif previous != aggregate or micro_uuid not in self._owned:
+            action = "RELOAD_HEARTBEAT"
+        else:
+            return
+
+        try:
+            await publish_agent_control(
+                micro_uuid,
+                action=action,
+                data={"interval_sec": aggregate} if aggregate is not None else None,
+            )
+        except Exception:
+            self._retry = True
+            raise
+
+        if aggregate is None:
+            self._running.pop(micro_uuid, None)
+        else:
+            self._running[micro_uuid] = aggregate
+            self._owned.add(micro_uuid)
+        logger.info(
+            "[cluster] heartbeat %s uuid=%s interval=%s (owner=%s)",
+            action,
+            micro_uuid,
+            aggregate,
+            self.node_id,
+        )
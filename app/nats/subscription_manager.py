@@ -1,48 +1,231 @@
 import asyncio
+import time
 
+from app.core.config import settings
 from app.core.logging import logger
 
 
+def subject_matches(pattern: str, subject: str) -> bool:
+    """
+    NATS wildcard match: `*` matches one token, a trailing `>` one or more.
+    """
+    pattern_tokens = pattern.split(".")
+    subject_tokens = subject.split(".")
+    for index, token in enumerate(pattern_tokens):
+        if token == ">":
+            return index == len(pattern_tokens) - 1 and len(subject_tokens) > index
+        if index >= len(subject_tokens):
+            return False
+        if token != "*" and token != subject_tokens[index]:
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
+
+
+def pending_limits_for(subject: str) -> tuple[int, int]:
+    """
+    (pending_msgs_limit, pending_bytes_limit) for subject: first matching
+    NATS_SUBJECT_PENDING_LIMITS entry, falling back to the global limits.
+    """
+    msgs_limit = settings.NATS_PENDING_MSGS_LIMIT
+    bytes_limit = settings.NATS_PENDING_BYTES_LIMIT
+    for pattern, limits in settings.NATS_SUBJECT_PENDING_LIMITS.items():
+        if subject_matches(pattern, subject):
+            return limits.get("msgs", msgs_limit), limits.get("bytes", bytes_limit)
+    return msgs_limit, bytes_limit
+
+
+def is_conflated(subject: str) -> bool:
+    return any(subject_matches(pattern, subject) for pattern in settings.NATS_CONFLATE_SUBJECTS)
+
+
+class SubjectFlow:
+    """
+    Per-subscription flow-control state: slow-consumer drop counters and,
+    for conflated subjects, the latest undelivered message.
+    """
+
+    __slots__ = (
+        "conflate",
+        "dropped",
+        "conflated",
+        "latest",
+        "drainer",
+        "unlogged_drops",
+        "last_drop_log",
+    )
+
+    def __init__(self, conflate: bool):
+        self.conflate = conflate
+        self.dropped = 0
+        self.conflated = 0
+        self.latest = None
+        self.drainer: asyncio.Task | None = None
+        self.unlogged_drops = 0
+        self.last_drop_log = 0.0
+
+
 class NatsSubscriptionManager:
     def __init__(self, nc, on_message_cb):
         self._nc = nc
         self._on_message_cb = on_message_cb
         self._subs: dict[str, object] = {}
         self._ref_counts: dict[str, int] = {}
+        # subject -> future resolved once its in-flight NATS subscribe settles
+        self._pending: dict[str, asyncio.Future] = {}
+        # subject -> flow-control state, kept while the subscription is active
+        self._flows: dict[str, SubjectFlow] = {}
+        # drops reported for subscriptions without a flow
+        self._untracked_flow = SubjectFlow(conflate=False)
+        self.dropped_total = 0
+        self.conflated_total = 0
         self._lock = asyncio.Lock()
 
+    def ref_count(self, subject: str) -> int:
+        return self._ref_counts.get(subject, 0)
+
+    @property
+    def active_subjects(self) -> int:
+        return len(self._subs)
+
+    def flow(self, subject: str) -> SubjectFlow | None:
+        return self._flows.get(subject)
+
+    def pending_msgs(self, subject: str) -> int | None:
+        sub = self._subs.get(subject)
+        return getattr(sub, "pending_msgs", None) if sub is not None else None
+
+    def record_slow_consumer(self, subject: str):
+        """
+        Attribute a nats-py SlowConsumerError (one dropped message) to the
+        subscription subject it was reported for, wildcards included.
+        """
+        self.dropped_total += 1
+        flow = self._flows.get(subject)
+        tracked = flow is not None
+        if not tracked:
+            # Subscriptions the manager does not own (cluster control) or
+            # subjects torn down while drops were still being reported share
+            # one throttled counter.
+            flow = self._untracked_flow
+
+        flow.dropped += 1
+        flow.unlogged_drops += 1
+        now = time.monotonic()
+        if now - flow.last_drop_log >= settings.NATS_SLOW_CONSUMER_LOG_INTERVAL_SEC:
+            logger.warning(
+                "[nats] slow consumer subject=%s%s dropped=%s (+%s since last report) pending=%s",
+                subject,
+                "" if tracked else " (untracked)",
+                flow.dropped,
+                flow.unlogged_drops,
+                self.pending_msgs(subject),
+            )
+            flow.unlogged_drops = 0
+            flow.last_drop_log = now
+
+    def _message_cb(self, subject: str, flow: SubjectFlow):
+        if not flow.conflate:
+            return self._on_message_cb
+
+        async def conflate(msg):
+            # Returns immediately so the nats-py pending queue never backs up,
+            # only the newest message waits for the in-progress fan-out.
+            if flow.latest is not None:
+                flow.conflated += 1
+                self.conflated_total += 1
+            flow.latest = msg
+            if flow.drainer is None:
+                flow.drainer = asyncio.create_task(self._drain_latest(flow))
+
+        return conflate
+
+    async def _drain_latest(self, flow: SubjectFlow):
+        try:
+            while flow.latest is not None:
+                msg, flow.latest = flow.latest, None
+                await self._on_message_cb(msg)
+        finally:
+            flow.drainer = None
+
     async def start(self, subject: str):
         """
         Increment local interest for subject and ensure NATS subscription exists.
+
+        The manager lock only guards bookkeeping; the NATS round trip runs
+        outside it so subscribes to different subjects do not queue behind
+        each other. There is at most one subscribe in flight per subject:
+        concurrent starts, including a re-start after the interest dropped
+        to 0 mid-subscribe, wait on it instead of issuing a second one.
         """
         async with self._lock:
             current = self._ref_counts.get(subject, 0)
             next_count = current + 1
             self._ref_counts[subject] = next_count
 
-            if current > 0:
+            waiter = self._pending.get(subject)
+            if waiter is None and current == 0:
+                activated = asyncio.get_running_loop().create_future()
+                self._pending[subject] = activated
+            else:
                 logger.debug(
                     "[nats] subscribe ref++ subject=%s refs=%s",
                     subject,
                     next_count,
                 )
-                return
 
-            logger.info("[nats] subscribe %s", subject)
-            try:
-                sub = await self._nc.subscribe(subject, cb=self._on_message_cb)
-            except Exception:
-                self._ref_counts.pop(subject, None)
-                logger.exception("[nats] subscribe failed subject=%s", subject)
-                raise
+        if waiter is not None:
+            await asyncio.shield(waiter)
+            return
+        if current > 0:
+            return
 
-            self._subs[subject] = sub
-            logger.info(
-                "[nats] subject active=%s refs=%s total_subjects=%s",
+        msgs_limit, bytes_limit = pending_limits_for(subject)
+        flow = SubjectFlow(is_conflated(subject))
+        logger.info(
+            "[nats] subscribe %s pending_limits=%s/%sB conflate=%s",
+            subject,
+            msgs_limit,
+            bytes_limit,
+            flow.conflate,
+        )
+        try:
+            sub = await self._nc.subscribe(
                 subject,
-                next_count,
-                len(self._subs),
+                cb=self._message_cb(subject, flow),
+                pending_msgs_limit=msgs_limit,
+                pending_bytes_limit=bytes_limit,
             )
+        except BaseException as e:
+            async with self._lock:
+                # Waiters' refs go too: they observe the same failure.
+                self._ref_counts.pop(subject, None)
+                self._pending.pop(subject, None)
+            activated.set_exception(e)
+            # Mark retrieved, waiters (if any) re-raise it themselves.
+            activated.exception()
+            logger.exception("[nats] subscribe failed subject=%s", subject)
+            raise
+
+        async with self._lock:
+            self._pending.pop(subject, None)
+            orphaned = self._ref_counts.get(subject, 0) == 0
+            if not orphaned:
+                self._subs[subject] = sub
+                self._flows[subject] = flow
+        activated.set_result(None)
+
+        if orphaned:
+            # Every interested caller stopped while the subscribe was in flight.
+            logger.info("[nats] unsubscribe %s (interest dropped during subscribe)", subject)
+            await sub.unsubscribe()
+            return
+
+        logger.info(
+            "[nats] subject active=%s refs=%s total_subjects=%s",
+            subject,
+            self._ref_counts.get(subject, 0),
+            len(self._subs),
+        )
 
     async def stop(self, subject: str):
         """
@@ -66,8 +249,16 @@ class NatsSubscriptionManager:
 
             self._ref_counts.pop(subject, None)
             sub = self._subs.pop(subject, None)
+            flow = self._flows.pop(subject, None)
+            if flow is not None:
+                # A running drainer finishes its current fan-out and exits.
+                flow.latest = None
+            in_flight = subject in self._pending
 
         if sub is None:
+            if in_flight:
+                logger.debug("[nats] unsubscribe deferred, subscribe in flight subject=%s", subject)
+                return
             logger.warning("[nats] missing subscription object for subject=%s", subject)
             return
 
@@ -80,6 +271,11 @@ class NatsSubscriptionManager:
             to_stop = list(self._subs.items())
             self._subs.clear()
             self._ref_counts.clear()
+            for flow in self._flows.values():
+                flow.latest = None
+                if flow.drainer is not None:
+                    flow.drainer.cancel()
+            self._flows.clear()
 
         if not to_stop:
             return
@@ -0,0 +1,232 @@
+"""
+Read-only admin HTTP surface served from the WebSocket server's process_request hook.
+
+Endpoints (GET, JSON, paginated with ?limit=&offset=):
+- {prefix}/summary
+- {prefix}/subjects?sort=subscribers|rate
+- {prefix}/clients
+- {prefix}/heartbeats
+- {prefix}/traces
+
+All figures come from incrementally maintained counters (app.ws.stats and
+ClientSession); top-N orderings come from rankings updated alongside them
+while ADMIN_ENABLED is set, so requests never replay message history nor
+scan every subject.
+"""
+
+import hmac
+import json
+import time
+from http import HTTPStatus
+from itertools import islice
+from urllib.parse import parse_qs, urlsplit
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.ws.stats import rate_ranking, subject_stats, subscriber_ranking, trace_stats
+from app.ws.subscriptions import sessions, subscribers
+from app.ws.heartbeat import device_interval, heartbeat_cluster, heartbeat_subjects
+
+
+class AdminRequestError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _json_response(status: HTTPStatus, body: dict):
+    payload = json.dumps(body).encode()
+    headers = [
+        ("Content-Type", "application/json"),
+        ("Content-Length", str(len(payload))),
+        ("Cache-Control", "no-store"),
+    ]
+    return status, headers, payload
+
+
+def _int_param(query: dict[str, list[str]], name: str, default: int) -> int:
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise AdminRequestError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+    if value < 0:
+        raise AdminRequestError(HTTPStatus.BAD_REQUEST, f"{name} must be >= 0")
+    return value
+
+
+def _page_params(query: dict[str, list[str]]) -> tuple[int, int]:
+    limit = _int_param(query, "limit", settings.ADMIN_PAGE_SIZE)
+    offset = _int_param(query, "offset", 0)
+    return min(limit, settings.ADMIN_MAX_PAGE_SIZE), offset
+
+
+def _page(items: list, total: int, limit: int, offset: int) -> dict:
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "items": items,
+    }
+
+
+def _is_authorized(request_headers) -> bool:
+    if not settings.ADMIN_TOKEN:
+        return True
+    header = request_headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    return hmac.compare_digest(token.strip(), settings.ADMIN_TOKEN)
+
+
+def _summary(nats_manager, query) -> dict:
+    cluster = heartbeat_cluster()
+    return {
+        "subjects": len(subscribers),
+        "nats_subjects": nats_manager.active_subjects,
+        "nats_dropped": nats_manager.dropped_total,
+        "nats_conflated": nats_manager.conflated_total,
+        "clients": len(sessions),
+        "heartbeat_subjects": len(heartbeat_subjects()),
+        "cluster": cluster.describe() if cluster is not None else None,
+    }
+
+
+def _subjects(nats_manager, query) -> dict:
+    limit, offset = _page_params(query)
+    sort = (query.get("sort") or ["subscribers"])[0]
+    now = time.monotonic()
+
+    if sort == "subscribers":
+        subjects = subscriber_ranking.top(offset, limit)
+    elif sort == "rate":
+        subjects = rate_ranking.top(offset, limit)
+    else:
+        raise AdminRequestError(HTTPStatus.BAD_REQUEST, "sort must be subscribers or rate")
+
+    items = []
+    for subject in subjects:
+        stats = subject_stats.get(subject)
+        flow = nats_manager.flow(subject)
+        items.append(
+            {
+                "subject": subject,
+                "subscribers": len(subscribers.get(subject, ())),
+                "nats_refs": nats_manager.ref_count(subject),
+                "nats_pending": nats_manager.pending_msgs(subject),
+                "nats_dropped": flow.dropped if flow else 0,
+                "nats_conflated": flow.conflated if flow else 0,
+                "conflate": flow.conflate if flow else False,
+                "messages": stats.messages if stats else 0,
+                "bytes": stats.bytes if stats else 0,
+                "broadcast_skipped": stats.broadcast_skipped if stats else 0,
+                "rate": round(stats.rate(now), 3) if stats else 0.0,
+            }
+        )
+
+    return _page(items, len(subscribers), limit, offset)
+
+
+def _clients(nats_manager, query) -> dict:
+    limit, offset = _page_params(query)
+
+    items = [
+        {
+            "client": session.label,
+            "subjects": len(session.subjects),
+            "pending_sends": session.pending_sends,
+            "write_buffer_bytes": session.write_buffer_size(),
+            "messages_sent": session.messages_sent,
+            "bytes_sent": session.bytes_sent,
+            "send_failures": session.send_failures,
+            "send_skipped": session.send_skipped,
+            "last_send_latency_ms": (
+                round(session.last_send_latency * 1000, 3)
+                if session.last_send_latency is not None
+                else None
+            ),
+            "connected_at": session.connected_at,
+        }
+        for session in islice(sessions.values(), offset, offset + limit)
+    ]
+
+    return _page(items, len(sessions), limit, offset)
+
+
+def _heartbeats(nats_manager, query) -> dict:
+    limit, offset = _page_params(query)
+    controlled = heartbeat_subjects()
+
+    items = [
+        {"subject": subject, "uuid": micro_uuid, "interval_sec": device_interval(micro_uuid)}
+        for subject, micro_uuid in islice(controlled.items(), offset, offset + limit)
+    ]
+    return _page(items, len(controlled), limit, offset)
+
+
+def _traces(nats_manager, query) -> dict:
+    limit, offset = _page_params(query)
+
+    items = [
+        {"subject": subject, "reports": stats.reports, "segments": stats.as_dict()}
+        for subject, stats in islice(trace_stats.items(), offset, offset + limit)
+    ]
+    return _page(items, len(trace_stats), limit, offset)
+
+
+_ROUTES = {
+    "summary": _summary,
+    "subjects": _subjects,
+    "clients": _clients,
+    "heartbeats": _heartbeats,
+    "traces": _traces,
+}
+
+
+def build_admin_request_handler(nats_manager):
+    """
+    Build a websockets `process_request` hook serving the admin API.
+    Requests outside the admin prefix fall through to the WebSocket handshake.
+    """
+    prefix = "/" + settings.ADMIN_PATH_PREFIX.strip("/")
+    if settings.ADMIN_ENABLED and not settings.ADMIN_TOKEN:
+        logger.warning(
+            "[admin] ADMIN_ENABLED without ADMIN_TOKEN, %s is served unauthenticated on %s:%s",
+            prefix,
+            settings.WS_HOST,
+            settings.WS_PORT,
+        )
+
+    async def process_request(path: str, request_headers):
+        if not settings.ADMIN_ENABLED:
+            return None
+
+        parts = urlsplit(path)
+        if parts.path != prefix and not parts.path.startswith(prefix + "/"):
+            return None
+
+        if not _is_authorized(request_headers):
+            logger.warning("[admin] unauthorized request path=%s", parts.path)
+            return _json_response(HTTPStatus.UNAUTHORIZED, {"error": "unauthorized"})
+
+        route = parts.path[len(prefix):].strip("/") or "summary"
+        view = _ROUTES.get(route)
+        if view is None:
+            return _json_response(HTTPStatus.NOT_FOUND, {"error": f"unknown endpoint {route}"})
+
+        try:
+            body = view(nats_manager, parse_qs(parts.query))
+        except AdminRequestError as e:
+            return _json_response(e.status, {"error": e.message})
+        except Exception:
+            logger.exception("[admin] request failed path=%s", path)
+            return _json_response(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal error"})
+
+        logger.debug("[admin] served %s", parts.path)
+        return _json_response(HTTPStatus.OK, body)
+
+    return process_request
@@ -0,0 +1,237 @@
+"""
+Demand-driven heartbeat control.
+
+Every subscriber of a heartbeat subject declares the interval it wants
+("heartbeat_interval" seconds on subscribe, HEARTBEAT_DEFAULT_INTERVAL_SEC
+when omitted). Demand is aggregated per device uuid as the fastest interval
+any current subscriber wants, and the device is told about it through
+publish_agent_control:
+- START_HEARTBEAT when the first subscriber appears,
+- RELOAD_HEARTBEAT when a subscriber joins or the aggregate interval changes,
+- STOP_HEARTBEAT when the last subscriber leaves.
+START and RELOAD carry {"interval_sec": <aggregate>}, STOP carries {}.
+
+With CLUSTER_ENABLED the node-local aggregate is handed to the
+HeartbeatCluster instead (app.nats.cluster), which publishes commands based
+on demand across all gateway replicas.
+"""
+
+import asyncio
+from typing import Any
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.nats.publisher import publish_agent_control
+
+
+# subject -> device uuid
+_heartbeat_subjects: dict[str, str] = {}
+
+# device uuid -> {(session id, subject): desired interval}
+_device_demand: dict[str, dict[tuple[int, str], float]] = {}
+
+# device uuid -> interval last published to the device
+_device_interval: dict[str, float] = {}
+
+# (session id, subject) -> device uuid its demand is recorded under
+_demand_devices: dict[tuple[int, str], str] = {}
+
+_heartbeat_lock = asyncio.Lock()
+
+_cluster = None
+
+
+def set_heartbeat_cluster(cluster):
+    """
+    Route device commands through a HeartbeatCluster (None -> publish directly).
+    """
+    global _cluster
+    _cluster = cluster
+
+
+def heartbeat_cluster():
+    return _cluster
+
+
+def heartbeat_subjects() -> dict[str, str]:
+    """
+    Live view of heartbeat-controlled subjects (subject -> device uuid).
+    Callers must treat it as read-only.
+    """
+    return _heartbeat_subjects
+
+
+def device_interval(micro_uuid: str) -> float | None:
+    return _device_interval.get(micro_uuid)
+
+
+def extract_heartbeat_uuid(subject: str, data: dict[str, Any]) -> str | None:
+    event_name = data.get("event")
+    micro_uuid = data.get("uuid")
+    if event_name == settings.HEARTBEAT_EVENT_NAME:
+        if not isinstance(micro_uuid, str) or not micro_uuid.strip():
+            logger.warning(
+                "Heartbeat control skipped, invalid uuid in subscribe payload: %s",
+                data,
+            )
+            return None
+
+        return micro_uuid.strip()
+
+    # Fallback for legacy/partial subscribe payloads: parse from subject
+    parts = subject.split(".")
+    if len(parts) < 4:
+        return None
+
+    if parts[2] != "event":
+        return None
+
+    subject_event = ".".join(parts[3:])
+    if subject_event != settings.HEARTBEAT_EVENT_NAME:
+        return None
+
+    parsed_uuid = parts[1].strip()
+    if not parsed_uuid:
+        return None
+
+    logger.info(
+        "Heartbeat control fallback used (derived uuid/event from subject=%s)",
+        subject,
+    )
+    return parsed_uuid
+
+
+def extract_heartbeat_interval(data: dict[str, Any]) -> float:
+    """
+    Requested interval clamped to [HEARTBEAT_MIN_INTERVAL_SEC, HEARTBEAT_MAX_INTERVAL_SEC].
+    """
+    requested = data.get("heartbeat_interval")
+    if requested is None:
+        return settings.HEARTBEAT_DEFAULT_INTERVAL_SEC
+
+    if isinstance(requested, bool) or not isinstance(requested, (int, float)) or requested <= 0:
+        logger.warning(
+            "Invalid heartbeat_interval=%r in subscribe payload, using default",
+            requested,
+        )
+        return settings.HEARTBEAT_DEFAULT_INTERVAL_SEC
+
+    return min(
+        max(float(requested), settings.HEARTBEAT_MIN_INTERVAL_SEC),
+        settings.HEARTBEAT_MAX_INTERVAL_SEC,
+    )
+
+
+async def _publish(micro_uuid: str, action: str, interval: float | None, subject: str):
+    await publish_agent_control(
+        micro_uuid,
+        action=action,
+        data={"interval_sec": interval} if interval is not None else None,
+    )
+    logger.info(
+        "Heartbeat %s requested for subject=%s uuid=%s interval=%s",
+        action,
+        subject,
+        micro_uuid,
+        interval,
+    )
+
+
+async def declare_heartbeat_demand(
+    session_id: int,
+    subject: str,
+    micro_uuid: str | None,
+    interval: float,
+    added: bool,
+):
+    """
+    Record (or update) a subscriber's desired interval for the device behind subject.
+
+    Subscribers that carry no heartbeat hints still count towards the demand
+    of a subject that is already linked to a device.
+    """
+    async with _heartbeat_lock:
+        if micro_uuid is None:
+            micro_uuid = _heartbeat_subjects.get(subject)
+            if micro_uuid is None:
+                return
+        else:
+            existing_uuid = _heartbeat_subjects.get(subject)
+            if existing_uuid and existing_uuid != micro_uuid:
+                logger.warning(
+                    "Heartbeat subject %s already linked to uuid=%s, got uuid=%s (overwriting)",
+                    subject,
+                    existing_uuid,
+                    micro_uuid,
+                )
+            _heartbeat_subjects[subject] = micro_uuid
+
+        key = (session_id, subject)
+        linked_uuid = _demand_devices.get(key)
+        if linked_uuid is not None and linked_uuid != micro_uuid:
+            await _release_locked(key)
+
+        demand = _device_demand.setdefault(micro_uuid, {})
+        first = not demand
+        demand[key] = interval
+        _demand_devices[key] = micro_uuid
+
+        previous = _device_interval.get(micro_uuid)
+        aggregate = min(demand.values())
+        _device_interval[micro_uuid] = aggregate
+
+        if _cluster is not None:
+            await _cluster.set_local_interest(micro_uuid, aggregate)
+            return
+
+        if first:
+            action = "START_HEARTBEAT"
+        elif aggregate != previous or added:
+            action = "RELOAD_HEARTBEAT"
+        else:
+            return
+
+        await _publish(micro_uuid, action, aggregate, subject)
+
+
+async def release_heartbeat_demand(session_id: int, subject: str):
+    """
+    Drop a subscriber's demand; stop or slow the device down if it was the last/fastest one.
+    """
+    async with _heartbeat_lock:
+        await _release_locked((session_id, subject))
+
+
+async def _release_locked(key: tuple[int, str]):
+    micro_uuid = _demand_devices.pop(key, None)
+    if micro_uuid is None:
+        return
+
+    subject = key[1]
+    demand = _device_demand.get(micro_uuid, {})
+    demand.pop(key, None)
+
+    if _heartbeat_subjects.get(subject) == micro_uuid and not any(
+        key_subject == subject for _, key_subject in demand
+    ):
+        _heartbeat_subjects.pop(subject, None)
+
+    if not demand:
+        _device_demand.pop(micro_uuid, None)
+        _device_interval.pop(micro_uuid, None)
+        if _cluster is not None:
+            await _cluster.set_local_interest(micro_uuid, None)
+            return
+        await _publish(micro_uuid, "STOP_HEARTBEAT", None, subject)
+        return
+
+    previous = _device_interval.get(micro_uuid)
+    aggregate = min(demand.values())
+    if aggregate == previous:
+        return
+
+    _device_interval[micro_uuid] = aggregate
+    if _cluster is not None:
+        await _cluster.set_local_interest(micro_uuid, aggregate)
+        return
+    await _publish(micro_uuid, "RELOAD_HEARTBEAT", aggregate, subject)
@@ -1,68 +1,148 @@
 import json
 import asyncio
+import base64
+import struct
+import time
+from functools import lru_cache
 
-from app.ws.subscriptions import (
-    get_subscribers,
-    ws_label,
-)
+import websockets
+
+from app.core.config import settings
+from app.ws.session import frame_size
+from app.ws.stats import record_subject_message, subject_stats
+from app.ws.subscriptions import get_subscribers
 from app.core.logging import logger
 
 
-SEND_TIMEOUT = 1.0  # seconds
+@lru_cache(maxsize=4096)
+def binary_frame_header(subject: str) -> bytes:
+    """
+    Binary frame layout: uint16 big-endian subject length, UTF-8 subject, raw payload.
+    """
+    encoded = subject.encode("utf-8")
+    return struct.pack("!H", len(encoded)) + encoded
+
+
+def _base64_envelope(subject: str, raw_data: bytes) -> dict:
+    return {
+        "subject": subject,
+        "data": {
+            "encoding": "base64",
+            "value": base64.b64encode(raw_data).decode("ascii"),
+        },
+        "payload_format": "binary",
+    }
+
+
+def _with_trace(msg: str, trace: dict) -> str:
+    # Splices the stamps into the already serialized envelope instead of
+    # re-serializing the whole payload per traced subscriber.
+    stamps = dict(trace, gw_send=round(time.time() * 1000, 3))
+    return f'{msg[:-1]}, "trace": {json.dumps(stamps)}}}'
+
+
+async def _send_traced(session, msg: str, subject: str, trace: dict) -> bool:
+    return await session.send(_with_trace(msg, trace), subject)
 
 
-async def _send_one(ws, msg: str, subject: str) -> bool:
+def _broadcast(subject: str, subs: list, msg: str | bytes, size: int | None = None) -> list:
     """
-    Send message to single WS client.
+    Non-awaiting fan-out for high-fanout subjects.
 
-    Returns:
-        True  -> delivered
-        False -> failed / timeout
+    The payload is encoded once and written synchronously to every ready
+    connection via websockets.broadcast. Connections whose write buffer is
+    above WS_BROADCAST_HIGH_WATER are skipped (message dropped for them and
+    counted). Connections with sends still in flight are returned so the
+    caller can deliver through the awaited path, which keeps their messages
+    in order.
     """
-    try:
-        await asyncio.wait_for(ws.send(msg), timeout=SEND_TIMEOUT)
-        return True
-    except asyncio.TimeoutError:
-        logger.warning(
-            f"WS send timeout to {ws_label(ws)} for subject {subject}"
-        )
-    except Exception as e:
-        logger.warning(
-            f"WS send failed to {ws_label(ws)} "
-            f"for subject {subject}: {e}"
-        )
-    return False
+    high_water = settings.WS_BROADCAST_HIGH_WATER
+    ready = []
+    busy = []
+    skipped = 0
+    for session in subs:
+        if not session.ws.open:
+            # Closing connections are reaped by their own handler.
+            continue
+        if session.write_buffer_size() > high_water:
+            session.send_skipped += 1
+            skipped += 1
+        elif session.pending_sends:
+            busy.append(session)
+        else:
+            ready.append(session)
 
+    started = time.monotonic()
+    websockets.broadcast([session.ws for session in ready], msg)
+    # Frames are written synchronously: latency is the time to hand them to
+    # every transport.
+    latency = time.monotonic() - started
 
-async def send_to_subscribers(subject: str, data: dict):
-    # ---------------------------------------------------------
-    # Snapshot subscribers (SAFE)
-    # ---------------------------------------------------------
-    subs = await get_subscribers(subject)
-    if not subs:
-        logger.debug("No WS subscribers for subject %s", subject)
-        return
+    if size is None:
+        size = frame_size(msg)
+    for session in ready:
+        session.messages_sent += 1
+        session.bytes_sent += size
+        session.last_send_latency = latency
 
-    try:
-        msg = json.dumps(data)
-    except (TypeError, ValueError):
-        logger.exception("Failed to serialize outbound WS payload for subject %s", subject)
-        return
+    if skipped:
+        stats = subject_stats.get(subject)
+        if stats is not None:
+            stats.broadcast_skipped += skipped
+        logger.warning(
+            "Broadcast for subject %s skipped %s/%s WS subscriber(s) above high-water mark",
+            subject,
+            skipped,
+            len(subs),
+        )
 
     logger.info(
-        "Sending event for subject %s to %s WS client(s): %s",
+        "Broadcast event for subject %s to %s/%s WS subscriber(s), %s deferred to awaited send",
         subject,
+        len(ready),
         len(subs),
-        [ws_label(ws) for ws in subs],
+        len(busy),
     )
+    return busy
+
+
+async def _fan_out(
+    subject: str,
+    subs: list,
+    msg,
+    size: int | None = None,
+    trace: dict | None = None,
+):
+    traced = []
+    if trace is not None and isinstance(msg, str):
+        traced = [session for session in subs if session.is_traced(subject)]
+        if traced:
+            subs = [session for session in subs if not session.is_traced(subject)]
+
+    if len(subs) >= settings.WS_BROADCAST_FANOUT_THRESHOLD:
+        subs = _broadcast(subject, subs, msg, size)
+        if not subs and not traced:
+            return
 
     # ---------------------------------------------------------
     # Fan-out PARALLEL (isolated clients)
     # ---------------------------------------------------------
     tasks = [
-        _send_one(ws, msg, subject)
-        for ws in subs
+        session.send(msg, subject, size)
+        for session in subs
     ]
+    tasks.extend(
+        _send_traced(session, msg, subject, trace)
+        for session in traced
+    )
+    subs = subs + traced
+
+    logger.info(
+        "Sending event for subject %s to %s WS client(s): %s",
+        subject,
+        len(subs),
+        [session.label for session in subs],
+    )
 
     results = await asyncio.gather(
         *tasks,
@@ -86,3 +166,65 @@ async def send_to_subscribers(subject: str, data: dict):
         delivered,
         len(subs),
     )
+
+
+async def send_to_subscribers(subject: str, data: dict, trace: dict | None = None):
+    # ---------------------------------------------------------
+    # Snapshot subscribers (SAFE)
+    # ---------------------------------------------------------
+    subs = await get_subscribers(subject)
+    if not subs:
+        logger.debug("No WS subscribers for subject %s", subject)
+        return
+
+    try:
+        msg = json.dumps(data)
+    except (TypeError, ValueError):
+        logger.exception("Failed to serialize outbound WS payload for subject %s", subject)
+        return
+
+    size = frame_size(msg)
+    record_subject_message(subject, size)
+    await _fan_out(subject, subs, msg, size, trace=trace)
+
+
+async def send_binary_to_subscribers(
+    subject: str,
+    raw_data: bytes,
+    trace: dict | None = None,
+):
+    """
+    Forward a non-UTF-8 NATS payload.
+
+    Sessions that opted into binary delivery for subject get a single binary
+    frame (header + raw payload, not base64-encoded), built once for all of
+    them. Remaining sessions get the legacy base64 JSON envelope, which is
+    only built when someone needs it.
+    """
+    subs = await get_subscribers(subject)
+    if not subs:
+        logger.debug("No WS subscribers for subject %s", subject)
+        return
+
+    binary_subs = []
+    json_subs = []
+    for session in subs:
+        if session.is_binary(subject):
+            binary_subs.append(session)
+        else:
+            json_subs.append(session)
+
+    record_subject_message(subject, len(raw_data))
+
+    sends = []
+    if binary_subs:
+        # One unfragmented message: a send timeout cancelling a fragmented
+        # one midway would make websockets fail the whole connection.
+        frame = binary_frame_header(subject) + raw_data
+        sends.append(_fan_out(subject, binary_subs, frame))
+
+    if json_subs:
+        msg = json.dumps(_base64_envelope(subject, raw_data))
+        sends.append(_fan_out(subject, json_subs, msg, trace=trace))
+
+    await asyncio.gather(*sends)
@@ -0,0 +1,147 @@
+import asyncio
+import itertools
+import time
+
+from app.core.logging import logger
+
+
+SEND_TIMEOUT = 1.0  # seconds
+
+_session_ids = itertools.count(1)
+
+
+def _peer_repr(ws) -> str:
+    peer = getattr(ws, "remote_address", None)
+    if isinstance(peer, tuple) and len(peer) >= 2:
+        return f"{peer[0]}:{peer[1]}"
+    return str(peer) if peer else "unknown"
+
+
+def _toggle(options: set[str] | None, subject: str, enabled: bool) -> set[str] | None:
+    if enabled:
+        if options is None:
+            return {subject}
+        options.add(subject)
+        return options
+    if options is not None:
+        options.discard(subject)
+        if not options:
+            return None
+    return options
+
+
+def frame_size(msg) -> int:
+    """
+    Payload bytes of a WS message: UTF-8 length for text, len() for binary.
+    """
+    if isinstance(msg, str):
+        return len(msg) if msg.isascii() else len(msg.encode("utf-8"))
+    return len(msg)
+
+
+class ClientSession:
+    """
+    Per-connection state: identity, subscribed subjects, send counters and
+    the send path itself. Registries reference sessions by `id` only.
+    """
+
+    __slots__ = (
+        "id",
+        "ws",
+        "label",
+        "subjects",
+        "binary_subjects",
+        "trace_subjects",
+        "connected_at",
+        "messages_sent",
+        "bytes_sent",
+        "send_failures",
+        "send_skipped",
+        "pending_sends",
+        "last_send_latency",
+    )
+
+    def __init__(self, ws):
+        self.id = next(_session_ids)
+        self.ws = ws
+        # Computed once, logged on every send.
+        self.label = f"ws#{self.id}@{_peer_repr(ws)}"
+        self.subjects: set[str] = set()
+        # Opt-in per-subject options, None until first used (most sessions
+        # never opt in and idle connections should stay small):
+        # subjects for which non-UTF-8 payloads are delivered as binary frames,
+        self.binary_subjects: set[str] | None = None
+        # subjects whose envelopes carry gateway trace stamps.
+        self.trace_subjects: set[str] | None = None
+        self.connected_at = time.time()
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.send_failures = 0
+        # Broadcast frames dropped because the write buffer was over high-water.
+        self.send_skipped = 0
+        self.pending_sends = 0
+        self.last_send_latency: float | None = None
+
+    def __repr__(self) -> str:
+        return f"<ClientSession {self.label}>"
+
+    def is_binary(self, subject: str) -> bool:
+        return self.binary_subjects is not None and subject in self.binary_subjects
+
+    def is_traced(self, subject: str) -> bool:
+        return self.trace_subjects is not None and subject in self.trace_subjects
+
+    def set_binary(self, subject: str, enabled: bool):
+        self.binary_subjects = _toggle(self.binary_subjects, subject, enabled)
+
+    def set_traced(self, subject: str, enabled: bool):
+        self.trace_subjects = _toggle(self.trace_subjects, subject, enabled)
+
+    def clear_options(self, subject: str | None = None):
+        """
+        Drop the options of subject, or of every subject when None.
+        """
+        if subject is None:
+            self.binary_subjects = None
+            self.trace_subjects = None
+            return
+        self.set_binary(subject, False)
+        self.set_traced(subject, False)
+
+    def write_buffer_size(self) -> int:
+        transport = getattr(self.ws, "transport", None)
+        if transport is None:
+            return 0
+        try:
+            return transport.get_write_buffer_size()
+        except Exception:
+            return 0
+
+    async def send(self, msg, subject: str, size: int | None = None) -> bool:
+        """
+        Send message to this WS client.
+
+        `msg` is a str (text frame) or a bytes-like object (binary frame).
+
+        Returns:
+            True  -> delivered
+            False -> failed / timeout
+        """
+        self.pending_sends += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.ws.send(msg), timeout=SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("WS send timeout to %s for subject %s", self.label, subject)
+        except Exception as e:
+            logger.warning("WS send failed to %s for subject %s: %s", self.label, subject, e)
+        else:
+            self.messages_sent += 1
+            self.bytes_sent += frame_size(msg) if size is None else size
+            self.last_send_latency = time.monotonic() - started
+            return True
+        finally:
+            self.pending_sends -= 1
+
+        self.send_failures += 1
+        return False
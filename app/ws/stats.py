@@ -0,0 +1,231 @@
+import bisect
+import math
+import time
+from itertools import islice
+
+from app.core.config import settings
+
+
+class SubjectStats:
+    """
+    Incrementally maintained per-subject delivery counters.
+
+    `rate` is an exponentially decayed messages/second estimate, so reading
+    it never requires replaying message history.
+    """
+
+    __slots__ = ("messages", "bytes", "broadcast_skipped", "_rate", "_rate_ts")
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.broadcast_skipped = 0
+        self._rate = 0.0
+        self._rate_ts = time.monotonic()
+
+    def record(self, size: int, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        tau = settings.ADMIN_RATE_WINDOW_SEC
+        self._rate = self._rate * math.exp(-(now - self._rate_ts) / tau) + 1.0 / tau
+        self._rate_ts = now
+        self.messages += 1
+        self.bytes += size
+
+    def rate(self, now: float | None = None) -> float:
+        now = time.monotonic() if now is None else now
+        tau = settings.ADMIN_RATE_WINDOW_SEC
+        return self._rate * math.exp(-(now - self._rate_ts) / tau)
+
+    def rank_key(self) -> float:
+        """
+        log(rate(t)) + t/tau, the same for every t: all rates decay at the
+        same speed, so ordering by this key equals ordering by current rate
+        and only changes when a message is recorded.
+        """
+        if self._rate <= 0.0:
+            return -math.inf
+        return math.log(self._rate) + self._rate_ts / settings.ADMIN_RATE_WINDOW_SEC
+
+
+class CountRanking:
+    """
+    subject -> count, readable in descending count order without a full scan.
+    Subjects are bucketed by count; only the sorted list of distinct counts
+    is walked.
+    """
+
+    def __init__(self):
+        self._counts: dict[str, int] = {}
+        # count -> subjects with that count (dict as insertion-ordered set)
+        self._buckets: dict[int, dict[str, None]] = {}
+        # non-empty counts, ascending
+        self._levels: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def set(self, subject: str, count: int):
+        previous = self._counts.pop(subject, 0)
+        if previous == count:
+            if count:
+                self._counts[subject] = count
+            return
+
+        if previous:
+            bucket = self._buckets[previous]
+            del bucket[subject]
+            if not bucket:
+                del self._buckets[previous]
+                del self._levels[bisect.bisect_left(self._levels, previous)]
+
+        if count:
+            self._counts[subject] = count
+            bucket = self._buckets.get(count)
+            if bucket is None:
+                bucket = self._buckets[count] = {}
+                bisect.insort(self._levels, count)
+            bucket[subject] = None
+
+    def top(self, offset: int, limit: int) -> list[str]:
+        subjects: list[str] = []
+        for count in reversed(self._levels):
+            if len(subjects) >= limit:
+                break
+            bucket = self._buckets[count]
+            if offset >= len(bucket):
+                offset -= len(bucket)
+                continue
+            subjects.extend(islice(bucket, offset, offset + limit - len(subjects)))
+            offset = 0
+        return subjects
+
+
+class RateRanking:
+    """
+    Subjects sorted by SubjectStats.rank_key, updated on every recorded message.
+    """
+
+    def __init__(self):
+        self._keys: dict[str, float] = {}
+        # (rank key, subject), ascending
+        self._entries: list[tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def update(self, subject: str, key: float):
+        previous = self._keys.get(subject)
+        if previous is not None:
+            del self._entries[bisect.bisect_left(self._entries, (previous, subject))]
+        self._keys[subject] = key
+        bisect.insort(self._entries, (key, subject))
+
+    def remove(self, subject: str):
+        previous = self._keys.pop(subject, None)
+        if previous is not None:
+            del self._entries[bisect.bisect_left(self._entries, (previous, subject))]
+
+    def top(self, offset: int, limit: int) -> list[str]:
+        end = len(self._entries) - offset
+        start = max(end - limit, 0)
+        if end <= 0:
+            return []
+        return [subject for _, subject in reversed(self._entries[start:end])]
+
+
+class SegmentStats:
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, value: float):
+        self.count += 1
+        self.total += value
+        self.last = value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "max_ms": round(self.max, 3),
+            "last_ms": round(self.last, 3),
+        }
+
+
+class TraceStats:
+    """
+    Latency breakdown aggregated from client trace reports (milliseconds).
+    Clock skew between device, gateway and browser shows up in the
+    cross-host segments, the gateway_queue segment is skew-free.
+    """
+
+    SEGMENTS = ("device_to_gateway", "gateway_queue", "gateway_to_client", "client_render")
+
+    __slots__ = ("reports", "segments")
+
+    def __init__(self):
+        self.reports = 0
+        self.segments = {name: SegmentStats() for name in self.SEGMENTS}
+
+    def as_dict(self) -> dict:
+        return {name: segment.as_dict() for name, segment in self.segments.items()}
+
+
+# subject -> SubjectStats (kept while subject has WS subscribers)
+subject_stats: dict[str, SubjectStats] = {}
+
+# subject -> TraceStats (only subjects that received trace reports)
+trace_stats: dict[str, TraceStats] = {}
+
+# admin top-N indexes, maintained alongside the counters above only while the
+# admin API is enabled (they cost a bisect/insort per delivered message)
+subscriber_ranking = CountRanking()
+rate_ranking = RateRanking()
+
+
+def ensure_subject_stats(subject: str) -> SubjectStats:
+    stats = subject_stats.get(subject)
+    if stats is None:
+        stats = subject_stats[subject] = SubjectStats()
+        if settings.ADMIN_ENABLED:
+            rate_ranking.update(subject, stats.rank_key())
+    return stats
+
+
+def set_subscriber_count(subject: str, count: int):
+    if settings.ADMIN_ENABLED:
+        subscriber_ranking.set(subject, count)
+
+
+def record_subject_message(subject: str, size: int):
+    # Only subjects with live WS interest are tracked, late NATS deliveries
+    # for an already emptied subject must not resurrect its entry.
+    stats = subject_stats.get(subject)
+    if stats is not None:
+        stats.record(size)
+        if settings.ADMIN_ENABLED:
+            rate_ranking.update(subject, stats.rank_key())
+
+
+def record_trace_report(subject: str, segments: dict[str, float]):
+    if subject not in subject_stats:
+        return
+    stats = trace_stats.get(subject)
+    if stats is None:
+        stats = trace_stats[subject] = TraceStats()
+    stats.reports += 1
+    for name, value in segments.items():
+        stats.segments[name].record(value)
+
+
+def drop_subject_stats(subject: str):
+    subject_stats.pop(subject, None)
+    trace_stats.pop(subject, None)
+    subscriber_ranking.set(subject, 0)
+    rate_ranking.remove(subject)
@@ -1,42 +1,56 @@
 import asyncio
 
 from app.core.logging import logger
+from app.ws.session import ClientSession
+from app.ws.stats import drop_subject_stats, ensure_subject_stats, set_subscriber_count
 
-# subject -> set(ws)
-subscribers: dict[str, set] = {}
+# session id -> ClientSession
+sessions: dict[int, ClientSession] = {}
 
-# ws -> set(subject)
-ws_sets: dict = {}
+# subject -> set(session id)
+subscribers: dict[str, set[int]] = {}
+
+# subject -> number of subscribers that opted into trace stamps
+traced_subscribers: dict[str, int] = {}
 
 _subs_lock = asyncio.Lock()
 
 
-def ws_label(ws) -> str:
-    peer = getattr(ws, "remote_address", None)
-    if isinstance(peer, tuple) and len(peer) >= 2:
-        peer_repr = f"{peer[0]}:{peer[1]}"
+def _count_traced(subject: str, delta: int):
+    count = traced_subscribers.get(subject, 0) + delta
+    if count > 0:
+        traced_subscribers[subject] = count
     else:
-        peer_repr = str(peer) if peer else "unknown"
-    return f"ws#{id(ws)}@{peer_repr}"
+        traced_subscribers.pop(subject, None)
+
+
+def has_traced_subscribers(subject: str) -> bool:
+    return subject in traced_subscribers
 
 
-async def add_subscription(subject: str, ws) -> bool:
+async def add_subscription(subject: str, session: ClientSession, traced: bool = False) -> bool:
     """
-    Add ws to subject.
+    Add session to subject (or update its trace opt-in when already subscribed).
 
     Returns:
-        added -> whether ws was newly added to subject
+        added -> whether session was newly added to subject
     """
     async with _subs_lock:
         subs = subscribers.setdefault(subject, set())
-        already = ws in subs
-        subs.add(ws)
-        ws_sets.setdefault(ws, set()).add(subject)
+        ensure_subject_stats(subject)
+        already = session.id in subs
+        subs.add(session.id)
+        session.subjects.add(subject)
+        set_subscriber_count(subject, len(subs))
+
+        if session.is_traced(subject) != traced:
+            session.set_traced(subject, traced)
+            _count_traced(subject, 1 if traced else -1)
 
         logger.info(
             "[subs] %s <- %s (%s) | total=%s",
             subject,
-            ws_label(ws),
+            session.label,
             "already" if already else "new",
             len(subs),
         )
@@ -44,83 +58,98 @@ async def add_subscription(subject: str, ws) -> bool:
         return not already
 
 
-async def remove_subscription(subject: str, ws) -> tuple[bool, bool]:
+async def remove_subscription(subject: str, session: ClientSession) -> tuple[bool, bool]:
     """
-    Remove ws from subject.
+    Remove session from subject.
 
     Returns:
-        removed  -> whether ws was removed from subject
+        removed  -> whether session was removed from subject
         is_empty -> whether subject transitioned to 0 subscribers
     """
     async with _subs_lock:
         subs = subscribers.get(subject)
-        if not subs or ws not in subs:
+        if not subs or session.id not in subs:
             return False, False
 
-        subs.remove(ws)
-        ws_subjects = ws_sets.get(ws)
-        if ws_subjects is not None:
-            ws_subjects.discard(subject)
-            if not ws_subjects:
-                ws_sets.pop(ws, None)
+        subs.remove(session.id)
+        session.subjects.discard(subject)
+        if session.is_traced(subject):
+            _count_traced(subject, -1)
+        session.clear_options(subject)
 
         logger.info(
             "[subs] %s -/-> %s | remaining=%s",
             subject,
-            ws_label(ws),
+            session.label,
             len(subs),
         )
 
         if not subs:
             subscribers.pop(subject, None)
+            drop_subject_stats(subject)
             logger.info("[subs] subject %s has no remaining WS subscribers", subject)
             return True, True
 
+        set_subscriber_count(subject, len(subs))
         return True, False
 
 
-async def remove_ws(ws) -> tuple[set[str], set[str]]:
+async def remove_session(session: ClientSession) -> tuple[set[str], set[str]]:
     """
-    Remove websocket from all subjects.
+    Remove session from all subjects and from the session registry.
 
     Returns:
-        removed_subjects: all subjects where ws was removed
+        removed_subjects: all subjects where session was removed
         emptied_subjects: subjects that transitioned to 0 subscribers
     """
     async with _subs_lock:
-        removed_subjects = ws_sets.pop(ws, set())
+        sessions.pop(session.id, None)
+        removed_subjects = session.subjects
+        session.subjects = set()
         emptied_subjects: set[str] = set()
 
+        for subject in session.trace_subjects or ():
+            _count_traced(subject, -1)
+        session.clear_options()
+
         for subject in removed_subjects:
             subs = subscribers.get(subject)
             if not subs:
                 continue
 
-            subs.discard(ws)
+            subs.discard(session.id)
             if not subs:
                 subscribers.pop(subject, None)
+                drop_subject_stats(subject)
                 emptied_subjects.add(subject)
+            else:
+                set_subscriber_count(subject, len(subs))
 
         logger.info(
             "[subs] %s removed from %s subjects",
-            ws_label(ws),
+            session.label,
             len(removed_subjects),
         )
 
-        return set(removed_subjects), emptied_subjects
+        return removed_subjects, emptied_subjects
 
 
-async def get_subscribers(subject: str) -> set:
+async def get_subscribers(subject: str) -> list[ClientSession]:
     """
-    Returns a snapshot of WS subscribers for subject.
+    Returns a snapshot of WS subscriber sessions for subject.
     """
     async with _subs_lock:
-        return set(subscribers.get(subject, set()))
+        ids = subscribers.get(subject)
+        if not ids:
+            return []
+        return [sessions[session_id] for session_id in ids if session_id in sessions]
 
 
-async def register_client(ws):
+async def register_client(ws) -> ClientSession:
     """
     Register new WS connection.
     """
+    session = ClientSession(ws)
     async with _subs_lock:
-        ws_sets.setdefault(ws, set())
+        sessions[session.id] = session
+    return session
@@ -1,35 +1,58 @@
 """
 WebSocket control-plane contract:
-- subscribe: {"action":"subscribe","subject":"...","event":"microcontroller_heartbeat","uuid":"..."}
+- subscribe: {"action":"subscribe","subject":"...","event":"microcontroller_heartbeat","uuid":"...","binary":false}
 - unsubscribe: {"action":"unsubscribe","subject":"..."}
 - unsubscribe_many: {"action":"unsubscribe_many","subjects":["...", "..."]}
+- trace_report: {"action":"trace_report","subject":"...","trace":{...},"client_recv":ms,"client_render":ms}
+
+Every action may carry an optional "id" (string or integer). When present, the
+gateway answers with {"type":"ack","id":...,"action":...,"result":{...}} on
+success, and echoes the id in {"type":"error",...} frames on failure.
+Actions from one connection run concurrently (at most WS_CONTROL_CONCURRENCY
+in flight); actions touching the same subject are still applied in order.
 
 Gateway validates only shape (required fields) and never enforces any subject schema.
 Heartbeat control is optional and activated when subscribe payload carries
 event == HEARTBEAT_EVENT_NAME and a valid uuid. As a fallback, gateway can
-derive uuid/event from the subject format.
+derive uuid/event from the subject format. Subscribers may add
+"heartbeat_interval" (seconds) to ask for a beat rate, see app.ws.heartbeat.
+
+Binary delivery is opt-in per subscription ("binary": true). Payloads that are
+not valid UTF-8 are then sent as binary frames laid out as
+uint16 big-endian subject length | UTF-8 subject | raw payload bytes,
+instead of the base64 JSON envelope. Resubscribing updates the option.
+
+Tracing is opt-in per subscription ("trace": true). JSON envelopes then carry
+"trace": {"gw_recv", "gw_send", "nats_ts"?} in epoch milliseconds, nats_ts
+coming from the TRACE_TIMESTAMP_HEADER NATS header when present. Clients may
+echo a sampled "trace" object back with trace_report, adding their own
+client_recv/client_render stamps, to feed the per-subject latency breakdown.
 """
 
 import asyncio
+import contextlib
 import json
+import math
 from typing import Any
 
 from app.core.config import settings
 from app.core.logging import logger
-from app.nats.publisher import publish_agent_control
+from app.ws.heartbeat import (
+    declare_heartbeat_demand,
+    extract_heartbeat_interval,
+    extract_heartbeat_uuid,
+    release_heartbeat_demand,
+)
+from app.ws.session import ClientSession
+from app.ws.stats import record_trace_report
 from app.ws.subscriptions import (
     add_subscription,
     register_client,
+    remove_session,
     remove_subscription,
-    remove_ws,
-    ws_label,
 )
 
 
-_heartbeat_subjects: dict[str, str] = {}
-_heartbeat_lock = asyncio.Lock()
-
-
 def _normalize_subject(subject: Any) -> str | None:
     if not isinstance(subject, str):
         return None
@@ -38,167 +61,183 @@ def _normalize_subject(subject: Any) -> str | None:
     return normalized or None
 
 
-def _extract_heartbeat_uuid(data: dict[str, Any]) -> str | None:
-    event_name = data.get("event")
-    micro_uuid = data.get("uuid")
-    if event_name == settings.HEARTBEAT_EVENT_NAME:
-        if not isinstance(micro_uuid, str) or not micro_uuid.strip():
-            logger.warning(
-                "Heartbeat control skipped, invalid uuid in subscribe payload: %s",
-                data,
-            )
-            return None
-
-        return micro_uuid.strip()
-
-    # Fallback for legacy/partial subscribe payloads: parse from subject
-    subject = _normalize_subject(data.get("subject"))
-    if not subject:
-        return None
-
-    parts = subject.split(".")
-    if len(parts) < 4:
-        return None
-
-    if parts[2] != "event":
-        return None
-
-    subject_event = ".".join(parts[3:])
-    if subject_event != settings.HEARTBEAT_EVENT_NAME:
-        return None
-
-    parsed_uuid = parts[1].strip()
-    if not parsed_uuid:
-        return None
+class ControlError(Exception):
+    """
+    Control action rejected; reported to the client as an error frame.
+    """
 
-    logger.info(
-        "Heartbeat control fallback used (derived uuid/event from subject=%s)",
-        subject,
-    )
-    return parsed_uuid
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
 
 
-async def _register_heartbeat_subject(subject: str, micro_uuid: str) -> bool:
-    async with _heartbeat_lock:
-        existing_uuid = _heartbeat_subjects.get(subject)
-        if existing_uuid == micro_uuid:
-            return True
+class _SubjectLocks:
+    """
+    Per-connection subject locks so actions touching the same subject keep
+    arrival order while actions on different subjects run concurrently.
+    Entries are dropped as soon as nobody holds or waits for them.
+    """
 
-        if existing_uuid and existing_uuid != micro_uuid:
-            logger.warning(
-                "Heartbeat subject %s already linked to uuid=%s, got uuid=%s (overwriting)",
-                subject,
-                existing_uuid,
-                micro_uuid,
-            )
+    def __init__(self):
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
 
-        _heartbeat_subjects[subject] = micro_uuid
-        return False
+    @contextlib.asynccontextmanager
+    async def hold(self, subjects: list[str]):
+        # Sorted acquisition keeps multi-subject actions deadlock-free.
+        ordered = sorted(set(subjects))
+        locks = []
+        for subject in ordered:
+            lock, users = self._locks.get(subject) or (asyncio.Lock(), 0)
+            self._locks[subject] = (lock, users + 1)
+            locks.append(lock)
 
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in acquired:
+                lock.release()
+            for subject in ordered:
+                lock, users = self._locks[subject]
+                if users <= 1:
+                    self._locks.pop(subject, None)
+                else:
+                    self._locks[subject] = (lock, users - 1)
 
-async def _pop_heartbeat_subject(subject: str) -> str | None:
-    async with _heartbeat_lock:
-        return _heartbeat_subjects.pop(subject, None)
 
+async def _send_ws_frame(session: ClientSession, payload: dict):
+    try:
+        await session.ws.send(json.dumps(payload))
+    except Exception:
+        logger.exception("Failed to send ws %s payload to %s", payload.get("type"), session.label)
 
-async def _send_start_heartbeat_if_needed(subject: str, micro_uuid: str):
-    already_running = await _register_heartbeat_subject(subject, micro_uuid)
-    action = "RELOAD_HEARTBEAT" if already_running else "START_HEARTBEAT"
 
-    await publish_agent_control(
-        micro_uuid,
-        action=action,
+async def _send_ws_error(
+    session: ClientSession,
+    code: str,
+    message: str,
+    request_id: str | int | None = None,
+):
+    payload = {"type": "error", "code": code, "message": message}
+    if request_id is not None:
+        payload["id"] = request_id
+    await _send_ws_frame(session, payload)
+
+
+async def _send_ws_ack(
+    session: ClientSession,
+    request_id: str | int,
+    action: str,
+    result: dict[str, Any],
+):
+    await _send_ws_frame(
+        session,
+        {"type": "ack", "id": request_id, "action": action, "result": result},
     )
-    logger.info("Heartbeat %s requested for subject=%s uuid=%s", action, subject, micro_uuid)
 
 
-async def _send_stop_heartbeat_if_needed(subject: str):
-    micro_uuid = await _pop_heartbeat_subject(subject)
-    if not micro_uuid:
-        return
+def _extract_request_id(data: dict[str, Any]) -> str | int | None:
+    request_id = data.get("id")
+    if request_id is None:
+        return None
+    if isinstance(request_id, bool) or not isinstance(request_id, (str, int)):
+        raise ControlError("INVALID_ID", "id must be a string or an integer")
+    return request_id
 
-    await publish_agent_control(
-        micro_uuid,
-        action="STOP_HEARTBEAT",
-    )
-    logger.info("Heartbeat STOP requested for subject=%s uuid=%s", subject, micro_uuid)
 
+def _action_subjects(data: dict[str, Any]) -> list[str]:
+    subject = _normalize_subject(data.get("subject"))
+    if subject:
+        return [subject]
 
-async def _send_ws_error(ws, code: str, message: str):
-    payload = {"type": "error", "code": code, "message": message}
-    try:
-        await ws.send(json.dumps(payload))
-    except Exception:
-        logger.exception("Failed to send ws error payload to %s", ws_label(ws))
+    subjects_raw = data.get("subjects")
+    if isinstance(subjects_raw, list):
+        return [
+            normalized
+            for normalized in (_normalize_subject(item) for item in subjects_raw)
+            if normalized
+        ]
+    return []
 
 
-async def _handle_subscribe(ws, data: dict[str, Any], nats_manager):
+async def _handle_subscribe(session: ClientSession, data: dict[str, Any], nats_manager) -> dict:
     subject = _normalize_subject(data.get("subject"))
     if not subject:
-        logger.warning("%s subscribe ignored, invalid subject", ws_label(ws))
-        await _send_ws_error(ws, "INVALID_SUBJECT", "subscribe requires non-empty subject")
-        return
+        logger.warning("%s subscribe ignored, invalid subject", session.label)
+        raise ControlError("INVALID_SUBJECT", "subscribe requires non-empty subject")
 
-    added = await add_subscription(subject, ws)
+    session.set_binary(subject, data.get("binary") is True)
+
+    added = await add_subscription(subject, session, traced=data.get("trace") is True)
 
     if added:
         try:
             await nats_manager.start(subject)
         except Exception:
             logger.exception("Failed to activate NATS subject=%s", subject)
-            await remove_subscription(subject, ws)
-            await _send_ws_error(
-                ws,
+            await remove_subscription(subject, session)
+            raise ControlError(
                 "NATS_SUBSCRIBE_FAILED",
                 f"cannot subscribe NATS subject={subject}",
             )
-            return
 
-    heartbeat_uuid = _extract_heartbeat_uuid(data)
-    if heartbeat_uuid and added:
-        try:
-            await _send_start_heartbeat_if_needed(subject, heartbeat_uuid)
-        except Exception:
-            logger.exception("Failed to publish heartbeat START for subject=%s", subject)
+    try:
+        await declare_heartbeat_demand(
+            session.id,
+            subject,
+            extract_heartbeat_uuid(subject, data),
+            extract_heartbeat_interval(data),
+            added,
+        )
+    except Exception:
+        logger.exception("Failed to publish heartbeat control for subject=%s", subject)
 
     if not added:
-        logger.info("%s subscribe ignored, already subscribed to %s", ws_label(ws), subject)
+        logger.info("%s subscribe ignored, already subscribed to %s", session.label, subject)
     else:
-        logger.info("%s subscribed to %s", ws_label(ws), subject)
+        logger.info("%s subscribed to %s", session.label, subject)
+
+    return {"subject": subject, "subscribed": True, "already": not added}
 
 
-async def _handle_unsubscribe(ws, data: dict[str, Any], nats_manager):
+async def _handle_unsubscribe(session: ClientSession, data: dict[str, Any], nats_manager) -> dict:
     subject = _normalize_subject(data.get("subject"))
     if not subject:
-        logger.warning("%s unsubscribe ignored, invalid subject", ws_label(ws))
-        await _send_ws_error(ws, "INVALID_SUBJECT", "unsubscribe requires non-empty subject")
-        return
+        logger.warning("%s unsubscribe ignored, invalid subject", session.label)
+        raise ControlError("INVALID_SUBJECT", "unsubscribe requires non-empty subject")
 
-    removed, emptied = await remove_subscription(subject, ws)
+    removed, _ = await remove_subscription(subject, session)
     if not removed:
-        logger.info("%s unsubscribe ignored, no active subscription for %s", ws_label(ws), subject)
-        return
+        logger.info("%s unsubscribe ignored, no active subscription for %s", session.label, subject)
+        return {"subject": subject, "unsubscribed": False}
 
     try:
         await nats_manager.stop(subject)
     except Exception:
         logger.exception("Failed to stop NATS subject=%s", subject)
 
-    if emptied:
-        try:
-            await _send_stop_heartbeat_if_needed(subject)
-        except Exception:
-            logger.exception("Failed to publish heartbeat STOP for subject=%s", subject)
+    try:
+        await release_heartbeat_demand(session.id, subject)
+    except Exception:
+        logger.exception("Failed to publish heartbeat control for subject=%s", subject)
 
-    logger.info("%s unsubscribed from %s", ws_label(ws), subject)
+    logger.info("%s unsubscribed from %s", session.label, subject)
+    return {"subject": subject, "unsubscribed": True}
 
 
-async def _handle_unsubscribe_many(ws, data: dict[str, Any], nats_manager):
+async def _handle_unsubscribe_many(
+    session: ClientSession,
+    data: dict[str, Any],
+    nats_manager,
+) -> dict:
     subjects_raw = data.get("subjects")
     if not isinstance(subjects_raw, list):
-        logger.warning("%s unsubscribe_many ignored, subjects is not a list", ws_label(ws))
-        await _send_ws_error(ws, "INVALID_SUBJECTS", "unsubscribe_many requires subjects list")
-        return
+        logger.warning("%s unsubscribe_many ignored, subjects is not a list", session.label)
+        raise ControlError("INVALID_SUBJECTS", "unsubscribe_many requires subjects list")
 
     subjects = {
         normalized
@@ -207,68 +246,162 @@ async def _handle_unsubscribe_many(ws, data: dict[str, Any], nats_manager):
     }
 
     if not subjects:
-        logger.info("%s unsubscribe_many ignored, no valid subjects provided", ws_label(ws))
-        return
+        logger.info("%s unsubscribe_many ignored, no valid subjects provided", session.label)
+        return {"unsubscribed": []}
 
+    unsubscribed = []
     for subject in subjects:
-        removed, emptied = await remove_subscription(subject, ws)
+        removed, _ = await remove_subscription(subject, session)
         if not removed:
             continue
+        unsubscribed.append(subject)
 
         try:
             await nats_manager.stop(subject)
         except Exception:
             logger.exception("Failed to stop NATS subject=%s", subject)
 
-        if emptied:
-            try:
-                await _send_stop_heartbeat_if_needed(subject)
-            except Exception:
-                logger.exception("Failed to publish heartbeat STOP for subject=%s", subject)
+        try:
+            await release_heartbeat_demand(session.id, subject)
+        except Exception:
+            logger.exception("Failed to publish heartbeat control for subject=%s", subject)
 
-    logger.info("%s unsubscribe_many handled for %s", ws_label(ws), sorted(subjects))
+    logger.info("%s unsubscribe_many handled for %s", session.label, sorted(subjects))
+    return {"unsubscribed": sorted(unsubscribed)}
+
+
+def _stamp(source: dict[str, Any], name: str) -> float | None:
+    value = source.get(name)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    try:
+        value = float(value)
+    except OverflowError:
+        return None
+    # json.loads accepts Infinity/NaN, which must not reach the aggregates.
+    return value if math.isfinite(value) else None
+
+
+async def _handle_trace_report(session: ClientSession, data: dict[str, Any], nats_manager) -> dict:
+    subject = _normalize_subject(data.get("subject"))
+    if not subject or not session.is_traced(subject):
+        raise ControlError("INVALID_SUBJECT", "trace_report requires a traced subscription subject")
+
+    trace = data.get("trace")
+    if not isinstance(trace, dict):
+        raise ControlError("INVALID_TRACE", "trace_report requires trace object")
+
+    nats_ts = _stamp(trace, "nats_ts")
+    gw_recv = _stamp(trace, "gw_recv")
+    gw_send = _stamp(trace, "gw_send")
+    client_recv = _stamp(data, "client_recv")
+    client_render = _stamp(data, "client_render")
+
+    segments = {}
+    if nats_ts is not None and gw_recv is not None:
+        segments["device_to_gateway"] = gw_recv - nats_ts
+    if gw_recv is not None and gw_send is not None:
+        segments["gateway_queue"] = gw_send - gw_recv
+    if gw_send is not None and client_recv is not None:
+        segments["gateway_to_client"] = client_recv - gw_send
+    if client_recv is not None and client_render is not None:
+        segments["client_render"] = client_render - client_recv
+
+    if not segments:
+        raise ControlError("INVALID_TRACE", "trace_report carries no usable timestamps")
+
+    record_trace_report(subject, segments)
+    return {"subject": subject, "segments": sorted(segments)}
+
+
+_ACTIONS = {
+    "subscribe": _handle_subscribe,
+    "unsubscribe": _handle_unsubscribe,
+    "unsubscribe_many": _handle_unsubscribe_many,
+    "trace_report": _handle_trace_report,
+}
+
+
+async def _process_action(
+    session: ClientSession,
+    data: dict[str, Any],
+    request_id: str | int | None,
+    nats_manager,
+    subject_locks: _SubjectLocks,
+    limiter: asyncio.Semaphore,
+):
+    action = data.get("action")
+    try:
+        async with subject_locks.hold(_action_subjects(data)):
+            result = await _ACTIONS[action](session, data, nats_manager)
+    except ControlError as e:
+        await _send_ws_error(session, e.code, e.message, request_id)
+    except Exception:
+        logger.exception("Failed to process action=%s from %s", action, session.label)
+        await _send_ws_error(session, "INTERNAL_ERROR", f"failed to process {action}", request_id)
+    else:
+        if request_id is not None:
+            await _send_ws_ack(session, request_id, action, result)
+    finally:
+        limiter.release()
 
 
 async def websocket_handler(ws, nats_manager):
-    await register_client(ws)
-    logger.info("Client connected %s", ws_label(ws))
+    session = await register_client(ws)
+    logger.info("Client connected %s", session.label)
+
+    subject_locks = _SubjectLocks()
+    limiter = asyncio.Semaphore(settings.WS_CONTROL_CONCURRENCY)
+    pending: set[asyncio.Task] = set()
 
     try:
         async for raw in ws:
             try:
                 data = json.loads(raw)
             except json.JSONDecodeError:
-                logger.warning("Invalid JSON from %s: %s", ws_label(ws), raw)
-                await _send_ws_error(ws, "INVALID_JSON", "message must be valid JSON")
+                logger.warning("Invalid JSON from %s: %s", session.label, raw)
+                await _send_ws_error(session, "INVALID_JSON", "message must be valid JSON")
                 continue
 
             if not isinstance(data, dict):
-                logger.warning("Ignored non-object payload from %s: %s", ws_label(ws), data)
-                await _send_ws_error(ws, "INVALID_PAYLOAD", "message must be a JSON object")
+                logger.warning("Ignored non-object payload from %s: %s", session.label, data)
+                await _send_ws_error(session, "INVALID_PAYLOAD", "message must be a JSON object")
+                continue
+
+            try:
+                request_id = _extract_request_id(data)
+            except ControlError as e:
+                await _send_ws_error(session, e.code, e.message)
                 continue
 
             action = data.get("action")
-            logger.info("Action received from %s: %s", ws_label(ws), action)
+            logger.info("Action received from %s: %s", session.label, action)
+
+            if not isinstance(action, str) or action not in _ACTIONS:
+                logger.warning("%s unknown action: %s", session.label, action)
+                await _send_ws_error(
+                    session,
+                    "UNKNOWN_ACTION",
+                    f"supported actions: {', '.join(_ACTIONS)}",
+                    request_id,
+                )
+                continue
 
-            try:
-                if action == "subscribe":
-                    await _handle_subscribe(ws, data, nats_manager)
-                elif action == "unsubscribe":
-                    await _handle_unsubscribe(ws, data, nats_manager)
-                elif action == "unsubscribe_many":
-                    await _handle_unsubscribe_many(ws, data, nats_manager)
-                else:
-                    logger.warning("%s unknown action: %s", ws_label(ws), action)
-                    await _send_ws_error(
-                        ws,
-                        "UNKNOWN_ACTION",
-                        "supported actions: subscribe, unsubscribe, unsubscribe_many",
-                    )
-            except Exception:
-                logger.exception("Failed to process action=%s from %s", action, ws_label(ws))
+            # Backpressure: stop reading control frames while the connection
+            # already has WS_CONTROL_CONCURRENCY actions in flight.
+            await limiter.acquire()
+            task = asyncio.create_task(
+                _process_action(session, data, request_id, nats_manager, subject_locks, limiter)
+            )
+            pending.add(task)
+            task.add_done_callback(pending.discard)
 
     finally:
-        removed_subjects, emptied_subjects = await remove_ws(ws)
+        # Let in-flight actions settle first so cleanup sees their final state.
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        removed_subjects, _ = await remove_session(session)
 
         for subject in removed_subjects:
             try:
@@ -276,17 +409,16 @@ async def websocket_handler(ws, nats_manager):
             except Exception:
                 logger.exception("Failed to stop NATS subject=%s on disconnect", subject)
 
-            if subject in emptied_subjects:
-                try:
-                    await _send_stop_heartbeat_if_needed(subject)
-                except Exception:
-                    logger.exception(
-                        "Failed to publish heartbeat STOP for subject=%s on disconnect",
-                        subject,
-                    )
+            try:
+                await release_heartbeat_demand(session.id, subject)
+            except Exception:
+                logger.exception(
+                    "Failed to publish heartbeat control for subject=%s on disconnect",
+                    subject,
+                )
 
         logger.info(
             "Client disconnected %s, removed from %s subjects",
-            ws_label(ws),
+            session.label,
             len(removed_subjects),
         )
@@ -0,0 +1,29 @@
+from app.core.config import settings
+from app.ws import admin
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.warnings: list[str] = []
+
+    def warning(self, msg, *args):
+        self.warnings.append(msg % args)
+
+
+def test_warns_when_enabled_without_token(monkeypatch):
+    recorder = RecordingLogger()
+    monkeypatch.setattr(admin, "logger", recorder)
+    monkeypatch.setattr(settings, "ADMIN_ENABLED", True)
+
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    admin.build_admin_request_handler(None)
+    assert recorder.warnings == []
+
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "")
+    admin.build_admin_request_handler(None)
+    assert len(recorder.warnings) == 1
+    assert "unauthenticated" in recorder.warnings[0]
+
+    monkeypatch.setattr(settings, "ADMIN_ENABLED", False)
+    admin.build_admin_request_handler(None)
+    assert len(recorder.warnings) == 1
@@ -0,0 +1,249 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.nats import publisher
+from app.nats.cluster import HeartbeatCluster
+
+
+class _Msg:
+    def __init__(self, subject: str, data: bytes):
+        self.subject = subject
+        self.data = data
+
+
+class _Subscription:
+    def __init__(self, bus: "Bus", subject: str, cb, latency: float):
+        self._bus = bus
+        self.subject = subject
+        self._cb = cb
+        self._latency = latency
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._deliver())
+
+    async def _deliver(self):
+        # In-order delivery per subscription, like nats-py.
+        while True:
+            sent_at, msg = await self._queue.get()
+            delay = sent_at + self._latency - asyncio.get_running_loop().time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._cb(msg)
+
+    async def unsubscribe(self):
+        self._bus.subs.remove(self)
+        self._task.cancel()
+
+
+class Bus:
+    """
+    In-memory stand-in for one NATS server shared by every node; device
+    commands are recorded instead of delivered.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.subs: list[_Subscription] = []
+        self.commands: list[tuple[str, str, float | None]] = []
+        self.fail_commands = False
+
+    async def subscribe(self, subject: str, cb=None, **kwargs):
+        sub = _Subscription(self, subject, cb, self.latency)
+        self.subs.append(sub)
+        return sub
+
+    async def publish(self, subject: str, payload: bytes = b"", headers=None):
+        if ".command." in subject:
+            if self.fail_commands:
+                raise RuntimeError("publish failed")
+            body = json.loads(payload)
+            self.commands.append(
+                (subject.split(".")[1], body["action"], body["data"].get("interval_sec"))
+            )
+            return
+        for sub in list(self.subs):
+            if sub.subject == subject:
+                sub._queue.put_nowait(
+                    (asyncio.get_running_loop().time(), _Msg(subject, payload))
+                )
+
+    def take_commands(self) -> list[tuple[str, str, float | None]]:
+        commands, self.commands = self.commands, []
+        return commands
+
+
+REFRESH = 0.05
+SETTLE = 0.1
+TTL = 0.25
+DEVICES = [f"dev-{index}" for index in range(20)]
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    monkeypatch.setattr(settings, "CLUSTER_REFRESH_SEC", REFRESH)
+    monkeypatch.setattr(settings, "CLUSTER_SETTLE_SEC", SETTLE)
+    monkeypatch.setattr(settings, "CLUSTER_LEASE_TTL_SEC", TTL)
+    bus = Bus()
+    monkeypatch.setattr(publisher, "_nats_client", bus)
+    return bus
+
+
+async def _settle(rounds: int = 4):
+    await asyncio.sleep(SETTLE + REFRESH * rounds)
+
+
+async def _crash(node: HeartbeatCluster):
+    # No leave announcement: peers only notice through lease expiry.
+    node._task.cancel()
+    await node._sub.unsubscribe()
+
+
+def _per_device(commands) -> dict[str, list[str]]:
+    actions: dict[str, list[str]] = {}
+    for micro_uuid, action, _ in commands:
+        actions.setdefault(micro_uuid, []).append(action)
+    return actions
+
+
+def _assert_single_owner(nodes, wanted):
+    owned = [node._owned for node in nodes]
+    assert set().union(*owned) == set(wanted)
+    assert sum(len(devices) for devices in owned) == len(wanted)
+    for node in nodes:
+        for micro_uuid in node._owned:
+            assert node.owner(micro_uuid) == node.node_id
+
+
+def test_one_command_per_device_across_membership_changes(bus):
+    async def scenario():
+        a, b, c = (HeartbeatCluster(bus, node_id=f"node-{name}") for name in "abc")
+        for node in (a, b, c):
+            await node.start()
+        await _settle()
+
+        # First interest: a single START per device, whichever node owns it.
+        for micro_uuid in DEVICES:
+            await a.set_local_interest(micro_uuid, 5.0)
+        await _settle()
+        assert _per_device(bus.take_commands()) == {
+            micro_uuid: ["START_HEARTBEAT"] for micro_uuid in DEVICES
+        }
+        _assert_single_owner([a, b, c], DEVICES)
+
+        # Slower interest from other nodes does not change the aggregate.
+        for index, micro_uuid in enumerate(DEVICES):
+            await (b if index % 2 else c).set_local_interest(micro_uuid, 10.0)
+        await _settle()
+        assert bus.take_commands() == []
+
+        # Join: only devices whose owner moved get one RELOAD, from the new owner.
+        before = {micro_uuid: a.owner(micro_uuid) for micro_uuid in DEVICES}
+        d = HeartbeatCluster(bus, node_id="node-d")
+        await d.start()
+        await _settle()
+        moved = {micro_uuid for micro_uuid in DEVICES if a.owner(micro_uuid) != before[micro_uuid]}
+        assert moved
+        assert _per_device(bus.take_commands()) == {
+            micro_uuid: ["RELOAD_HEARTBEAT"] for micro_uuid in moved
+        }
+        _assert_single_owner([a, b, c, d], DEVICES)
+
+        # Graceful leave hands d's devices back with one RELOAD each.
+        await d.stop()
+        await _settle()
+        assert _per_device(bus.take_commands()) == {
+            micro_uuid: ["RELOAD_HEARTBEAT"] for micro_uuid in moved
+        }
+        _assert_single_owner([a, b, c], DEVICES)
+
+        # Lease expiry: c crashes and its devices move with one RELOAD each.
+        owned_by_c = set(c._owned)
+        await _crash(c)
+        await asyncio.sleep(TTL + REFRESH * 4)
+        assert _per_device(bus.take_commands()) == {
+            micro_uuid: ["RELOAD_HEARTBEAT"] for micro_uuid in owned_by_c
+        }
+        _assert_single_owner([a, b], DEVICES)
+
+        # Interest ends: exactly one STOP per device.
+        for micro_uuid in DEVICES[1::2]:
+            await b.set_local_interest(micro_uuid, None)
+        await _settle()
+        assert bus.take_commands() == []
+        for micro_uuid in DEVICES:
+            await a.set_local_interest(micro_uuid, None)
+        await _settle()
+        assert _per_device(bus.take_commands()) == {
+            micro_uuid: ["STOP_HEARTBEAT"] for micro_uuid in DEVICES
+        }
+        _assert_single_owner([a, b], [])
+
+        for node in (a, b):
+            await node.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failed_command_publish_does_not_stop_the_node(bus):
+    async def scenario():
+        a = HeartbeatCluster(bus, node_id="node-a")
+        await a.start()
+        await _settle()
+        for micro_uuid in DEVICES:
+            await a.set_local_interest(micro_uuid, 5.0)
+        await _settle()
+        bus.take_commands()
+
+        # c joins while device commands fail.
+        bus.fail_commands = True
+        c = HeartbeatCluster(bus, node_id="node-c")
+        await c.start()
+        await _settle()
+        assert not c._task.done()
+        assert bus.take_commands() == []
+
+        bus.fail_commands = False
+        await _settle()
+        assert not c._task.done()
+        # The devices c took over are adopted once publishing recovers.
+        assert c._owned
+        assert _per_device(bus.take_commands()) == {
+            micro_uuid: ["RELOAD_HEARTBEAT"] for micro_uuid in c._owned
+        }
+        _assert_single_owner([a, c], DEVICES)
+
+        await c.stop()
+        await a.stop()
+
+    asyncio.run(scenario())
+
+
+def test_nodes_ready_in_the_same_window_send_one_start(bus):
+    # Announcements take longer to arrive than the nodes take to settle
+    # apart, so neither has seen the other's readiness when it becomes ready.
+    bus.latency = REFRESH * 0.6
+
+    async def scenario():
+        a = HeartbeatCluster(bus, node_id="node-a")
+        b = HeartbeatCluster(bus, node_id="node-b")
+        await a.start()
+        await b.start()
+        while not (a._ready and b._ready):
+            await asyncio.sleep(0.001)
+
+        for micro_uuid in DEVICES:
+            await a.set_local_interest(micro_uuid, 5.0)
+            await b.set_local_interest(micro_uuid, 5.0)
+        await _settle()
+
+        assert _per_device(bus.take_commands()) == {
+            micro_uuid: ["START_HEARTBEAT"] for micro_uuid in DEVICES
+        }
+        _assert_single_owner([a, b], DEVICES)
+
+        await a.stop()
+        await b.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,231 @@
+"""
+Several gateway processes (python -m app.main) clustered over one local
+nats-server, driven through their WebSocket control plane.
+
+Skipped unless a nats-server binary is available (on PATH or NATS_SERVER_BIN).
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import nats
+import pytest
+import websockets
+
+NATS_SERVER = os.environ.get("NATS_SERVER_BIN") or shutil.which("nats-server")
+
+pytestmark = pytest.mark.skipif(NATS_SERVER is None, reason="nats-server binary not available")
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+REFRESH = 0.2
+SETTLE = 0.3
+TTL = 1.0
+DEVICES = [f"dev-{index}" for index in range(8)]
+COMMAND_SUBJECTS = "device_communication.*.command.heartbeat"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_port(port: int, process: subprocess.Popen, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"process exited with {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"port {port} not listening")
+
+
+class Gateway:
+    def __init__(self, node_id: str, nats_url: str, log_dir: Path):
+        self.node_id = node_id
+        self.port = _free_port()
+        env = dict(
+            os.environ,
+            NATS_URL=nats_url,
+            WS_HOST="127.0.0.1",
+            WS_PORT=str(self.port),
+            LOG_DIR=str(log_dir / node_id),
+            CLUSTER_ENABLED="true",
+            CLUSTER_NODE_ID=node_id,
+            CLUSTER_REFRESH_SEC=str(REFRESH),
+            CLUSTER_SETTLE_SEC=str(SETTLE),
+            CLUSTER_LEASE_TTL_SEC=str(TTL),
+            ADMIN_ENABLED="true",
+            ADMIN_TOKEN="",
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "app.main"],
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        _wait_port(self.port, self.process)
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}"
+
+    def cluster(self) -> dict:
+        summary = f"http://127.0.0.1:{self.port}/admin/summary"
+        with urllib.request.urlopen(summary, timeout=2) as response:
+            return json.loads(response.read())["cluster"]
+
+    def stop(self, sig: int = signal.SIGTERM):
+        if self.process.poll() is None:
+            self.process.send_signal(sig)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+@pytest.fixture
+def nats_url():
+    port = _free_port()
+    server = subprocess.Popen(
+        [NATS_SERVER, "-a", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_port(port, server)
+        yield f"nats://127.0.0.1:{port}"
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+@pytest.fixture
+def gateways(nats_url, tmp_path):
+    started: list[Gateway] = []
+
+    def start(node_id: str) -> Gateway:
+        gateway = Gateway(node_id, nats_url, tmp_path)
+        started.append(gateway)
+        return gateway
+
+    yield start
+    for gateway in started:
+        gateway.stop()
+
+
+async def _wait_acting(nodes: list[Gateway], timeout: float = 10.0):
+    expected = sorted(node.node_id for node in nodes)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        clusters = await asyncio.gather(*(asyncio.to_thread(node.cluster) for node in nodes))
+        if all(
+            cluster["acting"]
+            and cluster["members"] == expected
+            and sorted([*cluster["ready_members"], cluster["node_id"]]) == expected
+            for cluster in clusters
+        ):
+            return
+        await asyncio.sleep(REFRESH / 2)
+    raise TimeoutError(f"cluster did not converge on {expected}")
+
+
+async def _subscribe_all(url: str):
+    ws = await websockets.connect(url)
+    for index, micro_uuid in enumerate(DEVICES):
+        await ws.send(
+            json.dumps(
+                {
+                    "action": "subscribe",
+                    "id": index,
+                    "subject": f"device_communication.{micro_uuid}.event.microcontroller_heartbeat",
+                    "event": "microcontroller_heartbeat",
+                    "uuid": micro_uuid,
+                }
+            )
+        )
+    acked = set()
+    while len(acked) < len(DEVICES):
+        frame = json.loads(await asyncio.wait_for(ws.recv(), timeout=5))
+        assert frame["type"] == "ack", frame
+        acked.add(frame["id"])
+    return ws
+
+
+class Commands:
+    def __init__(self):
+        self._received: list[tuple[str, str]] = []
+
+    async def on_message(self, msg):
+        self._received.append((msg.subject.split(".")[1], json.loads(msg.data)["action"]))
+
+    async def take(self, quiet: float = REFRESH * 5) -> dict[str, list[str]]:
+        await asyncio.sleep(quiet)
+        received, self._received = self._received, []
+        actions: dict[str, list[str]] = {}
+        for micro_uuid, action in received:
+            actions.setdefault(micro_uuid, []).append(action)
+        return actions
+
+
+def _reloads(actions: dict[str, list[str]]) -> int:
+    assert all(device_actions == ["RELOAD_HEARTBEAT"] for device_actions in actions.values()), actions
+    return len(actions)
+
+
+def test_gateway_replicas_send_one_command_per_device(nats_url, gateways):
+    async def scenario():
+        nc = await nats.connect(nats_url)
+        commands = Commands()
+        await nc.subscribe(COMMAND_SUBJECTS, cb=commands.on_message)
+
+        # Started together, like a rolling deploy of a fresh cluster.
+        nodes = [gateways(f"node-{index}") for index in range(3)]
+        await _wait_acting(nodes)
+
+        # The same devices are watched through every replica: one START each.
+        clients = [await _subscribe_all(node.url) for node in nodes]
+        assert await commands.take() == {micro_uuid: ["START_HEARTBEAT"] for micro_uuid in DEVICES}
+
+        # Graceful leave: each device the leaver owned is adopted with one RELOAD.
+        leaver = nodes.pop()
+        owned = (await asyncio.to_thread(leaver.cluster))["owned_devices"]
+        await clients.pop().close()
+        await asyncio.to_thread(leaver.stop)
+        assert _reloads(await commands.take()) == owned
+
+        # Crash: noticed through lease expiry, same outcome.
+        crashed = nodes.pop()
+        owned = (await asyncio.to_thread(crashed.cluster))["owned_devices"]
+        await asyncio.to_thread(crashed.stop, signal.SIGKILL)
+        await clients.pop().close()
+        assert _reloads(await commands.take(TTL + REFRESH * 5)) == owned
+
+        # Join: the new replica adopts its share without restarting devices.
+        joiner = gateways("node-3")
+        nodes.append(joiner)
+        await _wait_acting(nodes)
+        reloads = _reloads(await commands.take())
+        assert reloads == (await asyncio.to_thread(joiner.cluster))["owned_devices"]
+
+        # Last interest gone: exactly one STOP per device.
+        await clients.pop().close()
+        assert await commands.take() == {micro_uuid: ["STOP_HEARTBEAT"] for micro_uuid in DEVICES}
+
+        await nc.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from app.ws import heartbeat
+from app.ws.heartbeat import declare_heartbeat_demand, release_heartbeat_demand
+
+SUBJECT = "device_communication.dev-1.event.microcontroller_heartbeat"
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    sent: list[tuple[str, str, float | None]] = []
+
+    async def publish(micro_uuid, action, data=None):
+        sent.append((micro_uuid, action, (data or {}).get("interval_sec")))
+
+    monkeypatch.setattr(heartbeat, "publish_agent_control", publish)
+    monkeypatch.setattr(heartbeat, "_cluster", None)
+    yield sent
+    for registry in (
+        heartbeat._heartbeat_subjects,
+        heartbeat._device_demand,
+        heartbeat._device_interval,
+        heartbeat._demand_devices,
+    ):
+        assert registry == {}
+
+
+def _take(sent: list) -> list:
+    taken = list(sent)
+    sent.clear()
+    return taken
+
+
+def test_demand_lifecycle(commands):
+    async def scenario():
+        await declare_heartbeat_demand(1, SUBJECT, "dev-1", 10.0, added=True)
+        assert _take(commands) == [("dev-1", "START_HEARTBEAT", 10.0)]
+
+        # A faster subscriber speeds the device up.
+        await declare_heartbeat_demand(2, SUBJECT, "dev-1", 2.0, added=True)
+        assert _take(commands) == [("dev-1", "RELOAD_HEARTBEAT", 2.0)]
+
+        # The first subscriber changes its interval without changing the aggregate.
+        await declare_heartbeat_demand(1, SUBJECT, "dev-1", 5.0, added=False)
+        assert _take(commands) == []
+
+        # The fastest subscriber leaves: slow down to the next fastest.
+        await release_heartbeat_demand(2, SUBJECT)
+        assert _take(commands) == [("dev-1", "RELOAD_HEARTBEAT", 5.0)]
+        assert heartbeat.device_interval("dev-1") == 5.0
+
+        # Interval change of the only subscriber.
+        await declare_heartbeat_demand(1, SUBJECT, "dev-1", 20.0, added=False)
+        assert _take(commands) == [("dev-1", "RELOAD_HEARTBEAT", 20.0)]
+
+        await release_heartbeat_demand(1, SUBJECT)
+        assert _take(commands) == [("dev-1", "STOP_HEARTBEAT", None)]
+
+        # Releasing again is a no-op.
+        await release_heartbeat_demand(1, SUBJECT)
+        assert _take(commands) == []
+
+    asyncio.run(scenario())
+
+
+def test_slower_subscriber_leaving_keeps_interval(commands):
+    async def scenario():
+        await declare_heartbeat_demand(1, SUBJECT, "dev-1", 2.0, added=True)
+        await declare_heartbeat_demand(2, SUBJECT, "dev-1", 30.0, added=True)
+        assert _take(commands) == [
+            ("dev-1", "START_HEARTBEAT", 2.0),
+            ("dev-1", "RELOAD_HEARTBEAT", 2.0),
+        ]
+
+        await release_heartbeat_demand(2, SUBJECT)
+        assert _take(commands) == []
+
+        await release_heartbeat_demand(1, SUBJECT)
+        assert _take(commands) == [("dev-1", "STOP_HEARTBEAT", None)]
+
+    asyncio.run(scenario())
+
+
+def test_subscriber_without_hints_joins_linked_subject(commands):
+    async def scenario():
+        await declare_heartbeat_demand(1, SUBJECT, "dev-1", 10.0, added=True)
+        await declare_heartbeat_demand(2, SUBJECT, None, 3.0, added=True)
+        assert _take(commands) == [
+            ("dev-1", "START_HEARTBEAT", 10.0),
+            ("dev-1", "RELOAD_HEARTBEAT", 3.0),
+        ]
+
+        await release_heartbeat_demand(1, SUBJECT)
+        await release_heartbeat_demand(2, SUBJECT)
+        assert _take(commands) == [("dev-1", "STOP_HEARTBEAT", None)]
+
+    asyncio.run(scenario())
+
+
+def test_uuid_relink_moves_demand_to_new_device(commands):
+    async def scenario():
+        await declare_heartbeat_demand(1, SUBJECT, "dev-1", 5.0, added=True)
+        assert _take(commands) == [("dev-1", "START_HEARTBEAT", 5.0)]
+
+        await declare_heartbeat_demand(1, SUBJECT, "dev-2", 5.0, added=False)
+        assert _take(commands) == [
+            ("dev-1", "STOP_HEARTBEAT", None),
+            ("dev-2", "START_HEARTBEAT", 5.0),
+        ]
+        assert heartbeat.heartbeat_subjects() == {SUBJECT: "dev-2"}
+
+        await release_heartbeat_demand(1, SUBJECT)
+        assert _take(commands) == [("dev-2", "STOP_HEARTBEAT", None)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,28 @@
+import pytest
+
+from app.core.config import settings
+from app.main import _nats_header_timestamp
+
+
+class FakeMsg:
+    def __init__(self, value: str):
+        self.headers = {settings.TRACE_TIMESTAMP_HEADER: value}
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("1700000000", 1700000000000.0),
+        ("1700000000123", 1700000000123.0),
+        ("1700000000123456789", 1700000000123.4568),
+        ("2023-11-14T22:13:20+00:00", 1700000000000.0),
+        ("2023-11-14T22:13:20.123456789+00:00", 1700000000123.456),
+    ],
+)
+def test_header_timestamp_formats(value, expected):
+    assert _nats_header_timestamp(FakeMsg(value)) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("value", ["inf", "-inf", "Infinity", "nan", "NaN", "1e400", "garbage"])
+def test_header_timestamp_rejects_non_finite_and_garbage(value):
+    assert _nats_header_timestamp(FakeMsg(value)) is None
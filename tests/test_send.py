@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import json
+
+from websockets.protocol import State
+
+from app.core.config import settings
+from app.ws import stats, subscriptions
+from app.ws.send import binary_frame_header, send_binary_to_subscribers, send_to_subscribers
+from app.ws.subscriptions import add_subscription, register_client, remove_session
+
+
+class FakeWebSocket:
+    remote_address = ("127.0.0.1", 50000)
+    open = True
+    transport = None
+
+    def __init__(self):
+        self.sent: list = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+def test_binary_frame_layout():
+    assert binary_frame_header("a.b") == b"\x00\x03a.b"
+    assert binary_frame_header("ż") == b"\x00\x02" + "ż".encode()
+
+
+def test_binary_payload_sent_as_single_frame():
+    payload = b"\xff\x00\xfe"
+
+    async def scenario():
+        binary_ws, json_ws = FakeWebSocket(), FakeWebSocket()
+        binary_session = await register_client(binary_ws)
+        json_session = await register_client(json_ws)
+        binary_session.set_binary("a.b", True)
+        await add_subscription("a.b", binary_session)
+        await add_subscription("a.b", json_session)
+
+        await send_binary_to_subscribers("a.b", payload)
+
+        assert binary_ws.sent == [b"\x00\x03a.b" + payload]
+        assert binary_session.bytes_sent == 5 + len(payload)
+        envelope = json.loads(json_ws.sent[0])
+        assert base64.b64decode(envelope["data"]["value"]) == payload
+
+        await remove_session(binary_session)
+        await remove_session(json_session)
+        assert subscriptions.subscribers == {}
+
+    asyncio.run(scenario())
+
+
+class FakeTransport:
+    def __init__(self):
+        self.buffered = 0
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+
+class BroadcastWebSocket(FakeWebSocket):
+    """
+    Enough of the legacy protocol for websockets.broadcast to write to it.
+    """
+
+    state = State.OPEN
+    _fragmented_message_waiter = None
+
+    def __init__(self):
+        super().__init__()
+        self.transport = FakeTransport()
+        self.written: list = []
+
+    def write_frame_sync(self, fin, opcode, data):
+        self.written.append(bytes(data))
+
+
+async def _subscribed(count: int, subject: str = "s") -> list:
+    sessions = []
+    for _ in range(count):
+        session = await register_client(BroadcastWebSocket())
+        await add_subscription(subject, session)
+        sessions.append(session)
+    return sessions
+
+
+async def _cleanup(sessions: list):
+    for session in sessions:
+        await remove_session(session)
+    assert subscriptions.subscribers == {}
+
+
+def test_fanout_threshold_switches_to_broadcast(monkeypatch):
+    monkeypatch.setattr(settings, "WS_BROADCAST_FANOUT_THRESHOLD", 3)
+
+    async def scenario():
+        below = await _subscribed(2, "below")
+        above = await _subscribed(3, "above")
+
+        await send_to_subscribers("below", {"v": 1})
+        await send_to_subscribers("above", {"v": 1})
+
+        assert all(len(session.ws.sent) == 1 and not session.ws.written for session in below)
+        assert all(len(session.ws.written) == 1 and not session.ws.sent for session in above)
+
+        await _cleanup(below + above)
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_skips_above_high_water_and_defers_busy(monkeypatch):
+    monkeypatch.setattr(settings, "WS_BROADCAST_FANOUT_THRESHOLD", 1)
+    monkeypatch.setattr(settings, "WS_BROADCAST_HIGH_WATER", 100)
+
+    async def scenario():
+        ready, congested, busy = await _subscribed(3)
+        congested.ws.transport.buffered = 101
+        busy.pending_sends = 1
+
+        await send_to_subscribers("s", {"text": "zażółć"})
+
+        payload = json.dumps({"text": "zażółć"})
+        assert ready.ws.written == [payload.encode()]
+        assert ready.messages_sent == 1
+        assert ready.last_send_latency is not None
+
+        assert congested.ws.written == [] and congested.ws.sent == []
+        assert congested.send_skipped == 1
+        assert stats.subject_stats["s"].broadcast_skipped == 1
+
+        # Sessions with sends in flight go through the awaited path instead.
+        assert busy.ws.written == []
+        assert busy.ws.sent == [payload]
+
+        await _cleanup([ready, congested, busy])
+
+    asyncio.run(scenario())
+
+
+def test_bytes_sent_counts_encoded_bytes():
+    async def scenario():
+        session = await register_client(FakeWebSocket())
+        await add_subscription("s", session)
+
+        message = "zażółć"
+        await session.send(message, "s")
+        assert session.bytes_sent == len(message.encode("utf-8"))
+
+        await _cleanup([session])
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+import random
+
+from app.core.config import settings
+from app.ws import stats as stats_module
+from app.ws.stats import CountRanking, RateRanking, SubjectStats
+
+
+def test_count_ranking_matches_sorted_counts():
+    rng = random.Random(7)
+    ranking = CountRanking()
+    counts: dict[str, int] = {}
+    for _ in range(2000):
+        subject = f"s{rng.randrange(60)}"
+        count = max(counts.get(subject, 0) + rng.choice((-1, 1, 1)), 0)
+        counts[subject] = count
+        ranking.set(subject, count)
+
+    live = {subject: count for subject, count in counts.items() if count}
+    assert len(ranking) == len(live)
+    for offset, limit in ((0, 10), (5, 7), (0, 100), (55, 10), (100, 5)):
+        page = ranking.top(offset, limit)
+        expected = sorted(live.values(), reverse=True)[offset:offset + limit]
+        assert [live[subject] for subject in page] == expected
+    assert sorted(ranking.top(0, len(live))) == sorted(live)
+
+
+def test_rate_ranking_follows_decayed_rate():
+    ranking = RateRanking()
+    stats = {subject: SubjectStats() for subject in ("idle", "slow", "burst", "steady")}
+    for subject, subject_stats in stats.items():
+        ranking.update(subject, subject_stats.rank_key())
+
+    def record(subject: str, now: float):
+        stats[subject].record(1, now)
+        ranking.update(subject, stats[subject].rank_key())
+
+    for second in range(100):
+        record("steady", float(second))
+        if second % 10 == 0:
+            record("slow", float(second))
+    for _ in range(50):
+        record("burst", 0.0)
+
+    now = 100.0
+    expected = sorted(stats, key=lambda subject: stats[subject].rate(now), reverse=True)
+    assert ranking.top(0, 10) == expected
+    assert ranking.top(1, 2) == expected[1:3]
+    assert ranking.top(0, 10)[-1] == "idle"
+
+    ranking.remove("steady")
+    assert "steady" not in ranking.top(0, 10)
+    assert len(ranking) == 3
+
+
+def test_rankings_maintained_only_with_admin_enabled(monkeypatch):
+    for enabled in (False, True):
+        monkeypatch.setattr(settings, "ADMIN_ENABLED", enabled)
+        stats_module.ensure_subject_stats("s")
+        stats_module.set_subscriber_count("s", 1)
+        stats_module.record_subject_message("s", 10)
+
+        assert stats_module.subject_stats["s"].messages == 1
+        assert len(stats_module.subscriber_ranking) == int(enabled)
+        assert len(stats_module.rate_ranking) == int(enabled)
+
+        stats_module.drop_subject_stats("s")
+        assert len(stats_module.subscriber_ranking) == 0
+        assert len(stats_module.rate_ranking) == 0
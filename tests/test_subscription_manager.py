@@ -0,0 +1,113 @@
+import asyncio
+
+from app.nats import subscription_manager
+from app.nats.subscription_manager import NatsSubscriptionManager
+
+
+class FakeSubscription:
+    def __init__(self, nc: "SlowNats", subject: str):
+        self._nc = nc
+        self.subject = subject
+        self.unsubscribed = False
+
+    async def unsubscribe(self):
+        self.unsubscribed = True
+        self._nc.live.remove(self)
+
+
+class SlowNats:
+    """
+    nc.subscribe stand-in that blocks until the test releases it.
+    """
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.created: list[FakeSubscription] = []
+        self.live: list[FakeSubscription] = []
+
+    async def subscribe(self, subject: str, cb=None, **kwargs):
+        await self.release.wait()
+        sub = FakeSubscription(self, subject)
+        self.created.append(sub)
+        self.live.append(sub)
+        return sub
+
+
+async def _noop(msg):
+    pass
+
+
+def test_restart_during_inflight_subscribe_reuses_it():
+    async def scenario():
+        nc = SlowNats()
+        manager = NatsSubscriptionManager(nc, _noop)
+
+        first = asyncio.create_task(manager.start("a"))
+        await asyncio.sleep(0)
+        await manager.stop("a")
+        second = asyncio.create_task(manager.start("a"))
+        await asyncio.sleep(0)
+
+        nc.release.set()
+        await asyncio.gather(first, second)
+
+        assert len(nc.created) == 1
+        assert nc.live == nc.created
+        assert manager.ref_count("a") == 1
+        assert manager._subs["a"] is nc.created[0]
+        assert manager._pending == {}
+
+        await manager.stop("a")
+        assert nc.live == []
+        assert manager._subs == {}
+        assert manager._flows == {}
+
+    asyncio.run(scenario())
+
+
+def test_stop_during_inflight_subscribe_unsubscribes_orphan():
+    async def scenario():
+        nc = SlowNats()
+        manager = NatsSubscriptionManager(nc, _noop)
+
+        first = asyncio.create_task(manager.start("a"))
+        await asyncio.sleep(0)
+        await manager.stop("a")
+
+        nc.release.set()
+        await first
+
+        assert len(nc.created) == 1
+        assert nc.live == []
+        assert manager._subs == {}
+        assert manager._pending == {}
+
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_drops_attributed_to_wildcard_subscription():
+    async def scenario():
+        nc = SlowNats()
+        nc.release.set()
+        manager = NatsSubscriptionManager(nc, _noop)
+        await manager.start("device.*.event.>")
+
+        manager.record_slow_consumer("device.*.event.>")
+        manager.record_slow_consumer("device.*.event.>")
+
+        assert manager.flow("device.*.event.>").dropped == 2
+        assert manager.dropped_total == 2
+
+    asyncio.run(scenario())
+
+
+def test_untracked_slow_consumer_warnings_are_throttled(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(subscription_manager.logger, "warning", lambda *args: warnings.append(args))
+    manager = NatsSubscriptionManager(SlowNats(), _noop)
+
+    for _ in range(1000):
+        manager.record_slow_consumer("gateway.cluster.heartbeat")
+
+    assert manager.dropped_total == 1000
+    assert len(warnings) == 1
@@ -0,0 +1,45 @@
+import asyncio
+
+from app.ws import subscriptions
+from app.ws.subscriptions import (
+    add_subscription,
+    has_traced_subscribers,
+    register_client,
+    remove_session,
+    remove_subscription,
+)
+
+
+class FakeWebSocket:
+    remote_address = ("127.0.0.1", 50000)
+
+
+def test_traced_subscriber_count_follows_opt_in():
+    async def scenario():
+        first = await register_client(FakeWebSocket())
+        second = await register_client(FakeWebSocket())
+
+        await add_subscription("a", first)
+        assert not has_traced_subscribers("a")
+        assert first.trace_subjects is None
+
+        await add_subscription("a", first, traced=True)
+        await add_subscription("a", second, traced=True)
+        await add_subscription("b", second, traced=True)
+        assert subscriptions.traced_subscribers == {"a": 2, "b": 1}
+
+        # Re-subscribing without the option opts out.
+        await add_subscription("a", first)
+        assert subscriptions.traced_subscribers == {"a": 1, "b": 1}
+        assert first.trace_subjects is None
+
+        await remove_subscription("b", second)
+        assert subscriptions.traced_subscribers == {"a": 1}
+
+        await remove_session(second)
+        await remove_session(first)
+        assert subscriptions.traced_subscribers == {}
+        assert subscriptions.subscribers == {}
+        assert subscriptions.sessions == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+import pytest
+
+from app.ws import subscriptions
+from app.ws.websocket_handler import _stamp, websocket_handler
+
+
+@pytest.mark.parametrize("raw", ["Infinity", "-Infinity", "NaN", "1e400"])
+def test_stamp_rejects_non_finite_values(raw):
+    assert _stamp(json.loads(f'{{"t": {raw}}}'), "t") is None
+
+
+def test_stamp_accepts_numbers_only():
+    assert _stamp({"t": 12}, "t") == 12.0
+    assert _stamp({"t": 1.5}, "t") == 1.5
+    assert _stamp({"t": True}, "t") is None
+    assert _stamp({"t": "1"}, "t") is None
+    assert _stamp({"t": 10**400}, "t") is None
+
+
+class FakeWebSocket:
+    """
+    Feeds the handler a fixed list of frames and records what it sends back.
+    """
+
+    remote_address = ("127.0.0.1", 50000)
+
+    def __init__(self, frames: list):
+        self._frames = frames
+        self.sent: list[dict] = []
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for frame in self._frames:
+            yield frame if isinstance(frame, str) else json.dumps(frame)
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class FakeNatsManager:
+    def __init__(self, delays: dict[str, float] | None = None):
+        self._delays = delays or {}
+        self.calls: list[tuple[str, str]] = []
+
+    async def start(self, subject: str):
+        await asyncio.sleep(self._delays.get(subject, 0))
+        self.calls.append(("start", subject))
+
+    async def stop(self, subject: str):
+        self.calls.append(("stop", subject))
+
+
+def _run_handler(frames: list, nats_manager=None) -> tuple[FakeWebSocket, FakeNatsManager]:
+    ws = FakeWebSocket(frames)
+    nats_manager = nats_manager or FakeNatsManager()
+    asyncio.run(websocket_handler(ws, nats_manager))
+    return ws, nats_manager
+
+
+def test_non_string_action_is_unknown_action_with_id():
+    ws, _ = _run_handler([
+        {"action": ["subscribe"], "id": 1},
+        {"action": {"name": "subscribe"}, "id": "x"},
+        {"action": "nope"},
+    ])
+
+    assert [(frame["type"], frame["code"], frame.get("id")) for frame in ws.sent] == [
+        ("error", "UNKNOWN_ACTION", 1),
+        ("error", "UNKNOWN_ACTION", "x"),
+        ("error", "UNKNOWN_ACTION", None),
+    ]
+
+
+def test_ack_and_error_frames_echo_id():
+    ws, _ = _run_handler([
+        {"action": "subscribe", "subject": "a", "id": 7},
+        {"action": "subscribe", "id": "no-subject"},
+        {"action": "unsubscribe", "subject": "a", "id": 8},
+        {"action": "subscribe", "subject": "b", "id": True},
+        {"action": "unsubscribe", "subject": "zzz"},
+        "not json",
+        [1, 2],
+    ])
+
+    # Actions run as tasks, read-loop errors are sent inline: compare unordered.
+    assert sorted(ws.sent, key=json.dumps) == sorted([
+        {
+            "type": "ack",
+            "id": 7,
+            "action": "subscribe",
+            "result": {"subject": "a", "subscribed": True, "already": False},
+        },
+        {
+            "type": "error",
+            "code": "INVALID_SUBJECT",
+            "message": "subscribe requires non-empty subject",
+            "id": "no-subject",
+        },
+        {
+            "type": "ack",
+            "id": 8,
+            "action": "unsubscribe",
+            "result": {"subject": "a", "unsubscribed": True},
+        },
+        {"type": "error", "code": "INVALID_ID", "message": "id must be a string or an integer"},
+        {"type": "error", "code": "INVALID_JSON", "message": "message must be valid JSON"},
+        {"type": "error", "code": "INVALID_PAYLOAD", "message": "message must be a JSON object"},
+    ], key=json.dumps)
+
+
+def test_same_subject_actions_keep_order_while_others_run_concurrently():
+    # The NATS subscribe for "slow" takes a while: "fast" is handled in the
+    # meantime, the unsubscribe of "slow" still waits for its subscribe.
+    ws, nats_manager = _run_handler(
+        [
+            {"action": "subscribe", "subject": "slow", "id": 1},
+            {"action": "unsubscribe", "subject": "slow", "id": 2},
+            {"action": "subscribe", "subject": "fast", "id": 3},
+        ],
+        FakeNatsManager({"slow": 0.05}),
+    )
+
+    assert [frame["id"] for frame in ws.sent] == [3, 1, 2]
+    assert ws.sent[2]["result"] == {"subject": "slow", "unsubscribed": True}
+    assert nats_manager.calls == [
+        ("start", "fast"),
+        ("start", "slow"),
+        ("stop", "slow"),
+        ("stop", "fast"),
+    ]
+    assert subscriptions.sessions == {}
+    assert subscriptions.subscribers == {}
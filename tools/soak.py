@@ -0,0 +1,472 @@
+"""
+Soak harness for memory growth and registry leaks.
+
+Runs the real gateway stack in-process (websockets server, websocket_handler,
+NatsSubscriptionManager, on_nats_msg, heartbeat control) against an
+in-memory NATS stand-in, and drives randomized client churn at it:
+connect, subscribe (heartbeat/binary/trace variants), unsubscribe,
+unsubscribe_many, graceful close, abrupt transport abort, plus injected
+NATS subscribe/publish failures.
+
+RSS, tracemalloc totals and registry sizes are sampled periodically and
+printed as JSON lines. After a warm-up round the harness records a
+baseline; from then on every sample also carries the top tracemalloc
+allocation diffs against it. After the soak every client leaves and the
+run fails (exit 1) unless all registries are empty again and RSS / traced
+memory are back within tolerance of the baseline.
+
+    python -m tools.soak --duration 14400 --clients 300 --rate 500
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Gateway soak / leak regression harness")
+    parser.add_argument("--duration", type=float, default=600.0, help="soak phase length in seconds")
+    parser.add_argument("--warmup", type=float, default=30.0, help="warm-up phase length in seconds")
+    parser.add_argument("--clients", type=int, default=100, help="concurrent client loops")
+    parser.add_argument("--subjects", type=int, default=200, help="distinct NATS subjects")
+    parser.add_argument("--devices", type=int, default=50, help="distinct heartbeat devices")
+    parser.add_argument("--rate", type=float, default=200.0, help="NATS messages published per second")
+    parser.add_argument("--nats-error-rate", type=float, default=0.02, help="probability of injected NATS failures")
+    parser.add_argument("--abort-rate", type=float, default=0.3, help="probability a client drops its transport")
+    parser.add_argument("--sample-interval", type=float, default=30.0, help="seconds between samples")
+    parser.add_argument("--settle", type=float, default=5.0, help="seconds to wait after clients leave")
+    parser.add_argument("--rss-tolerance-mb", type=float, default=32.0)
+    parser.add_argument("--traced-tolerance-mb", type=float, default=8.0)
+    parser.add_argument("--tracemalloc-frames", type=int, default=1)
+    parser.add_argument("--top", type=int, default=10, help="allocation diffs reported per sample and at the end")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log-level", default="ERROR")
+    return parser.parse_args(argv)
+
+
+# ---------------------------------------------------------
+# Local NATS stand-in
+# ---------------------------------------------------------
+class InjectedNatsError(Exception):
+    pass
+
+
+class _LocalMsg:
+    __slots__ = ("subject", "data", "headers", "reply")
+
+    def __init__(self, subject: str, data: bytes, headers: dict | None):
+        self.subject = subject
+        self.data = data
+        self.headers = headers
+        self.reply = ""
+
+
+class _LocalSubscription:
+    def __init__(self, nc: "LocalNats", subject: str, cb, pending_msgs_limit: int):
+        self._nc = nc
+        self.subject = subject
+        self._cb = cb
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=pending_msgs_limit)
+        self._task = asyncio.create_task(self._deliver())
+
+    def enqueue(self, msg: _LocalMsg):
+        try:
+            self._queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            self._nc.dropped += 1
+
+    async def _deliver(self):
+        # Sequential per-subscription delivery, like nats-py.
+        while True:
+            msg = await self._queue.get()
+            try:
+                await self._cb(msg)
+            except Exception:
+                pass
+
+    async def unsubscribe(self):
+        self._nc._remove(self)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class LocalNats:
+    """
+    Minimal in-memory subset of nats.aio.client.Client used by the gateway:
+    exact-subject subscribe/unsubscribe and publish, with failure injection.
+    """
+
+    def __init__(self, rng: random.Random, error_rate: float):
+        self._rng = rng
+        self.error_rate = error_rate
+        self._subs: dict[str, list[_LocalSubscription]] = {}
+        self.published = 0
+        self.dropped = 0
+        self.injected_errors = 0
+
+    def _maybe_fail(self, operation: str):
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.injected_errors += 1
+            raise InjectedNatsError(f"injected {operation} failure")
+
+    async def subscribe(self, subject: str, queue: str = "", cb=None, pending_msgs_limit: int = 512, **kwargs):
+        await asyncio.sleep(self._rng.random() * 0.005)
+        self._maybe_fail("subscribe")
+        sub = _LocalSubscription(self, subject, cb, pending_msgs_limit)
+        self._subs.setdefault(subject, []).append(sub)
+        return sub
+
+    def _remove(self, sub: _LocalSubscription):
+        subs = self._subs.get(sub.subject)
+        if subs and sub in subs:
+            subs.remove(sub)
+            if not subs:
+                self._subs.pop(sub.subject, None)
+
+    async def publish(self, subject: str, payload: bytes = b"", headers: dict | None = None):
+        if ".command." in subject:
+            # Device-bound control traffic is where publish failures hurt.
+            self._maybe_fail("publish")
+        self.published += 1
+        for sub in self._subs.get(subject, ()):
+            sub.enqueue(_LocalMsg(subject, payload, headers))
+
+    def subscription_count(self) -> int:
+        return sum(len(subs) for subs in self._subs.values())
+
+
+# ---------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # Peak, not current: only a coarse fallback off Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def traced_mb() -> float:
+    return tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+
+
+def top_allocation_diffs(baseline: tracemalloc.Snapshot, limit: int) -> list[str]:
+    return [
+        str(stat)
+        for stat in tracemalloc.take_snapshot().compare_to(baseline, "lineno")[:limit]
+    ]
+
+
+def registry_sizes(nats_manager, nc: LocalNats) -> dict[str, int]:
+    from app.ws import heartbeat, stats, subscriptions
+
+    return {
+        "sessions": len(subscriptions.sessions),
+        "subscribers": len(subscriptions.subscribers),
+        "traced_subscribers": len(subscriptions.traced_subscribers),
+        "subject_stats": len(stats.subject_stats),
+        "trace_stats": len(stats.trace_stats),
+        "subscriber_ranking": len(stats.subscriber_ranking),
+        "rate_ranking": len(stats.rate_ranking),
+        "heartbeat_subjects": len(heartbeat._heartbeat_subjects),
+        "device_demand": len(heartbeat._device_demand),
+        "device_interval": len(heartbeat._device_interval),
+        "demand_devices": len(heartbeat._demand_devices),
+        "nats_subs": len(nats_manager._subs),
+        "nats_ref_counts": len(nats_manager._ref_counts),
+        "nats_pending": len(nats_manager._pending),
+        "nats_flows": len(nats_manager._flows),
+        "local_nats_subscriptions": nc.subscription_count(),
+    }
+
+
+def _emit(event: str, **fields):
+    print(json.dumps({"event": event, "t": round(time.time(), 3), **fields}), flush=True)
+
+
+# ---------------------------------------------------------
+# Load
+# ---------------------------------------------------------
+class Scenario:
+    def __init__(self, args: argparse.Namespace, rng: random.Random, url: str, heartbeat_event: str):
+        self.args = args
+        self.rng = rng
+        self.url = url
+        self.plain_subjects = [f"soak.{i}.event.reading" for i in range(args.subjects)]
+        self.heartbeat_subjects = [
+            f"device_communication.dev{i:04d}.event.{heartbeat_event}"
+            for i in range(args.devices)
+        ]
+        self.heartbeat_event = heartbeat_event
+        self.connections = 0
+        self.actions = 0
+        self.received = 0
+
+    def _subscribe_payload(self) -> dict:
+        rng = self.rng
+        if rng.random() < 0.3:
+            subject = rng.choice(self.heartbeat_subjects)
+            payload = {"action": "subscribe", "subject": subject}
+            if rng.random() < 0.5:
+                payload["event"] = self.heartbeat_event
+                payload["uuid"] = subject.split(".")[1]
+            if rng.random() < 0.5:
+                payload["heartbeat_interval"] = rng.choice([1, 5, 30, 120])
+        else:
+            payload = {"action": "subscribe", "subject": rng.choice(self.plain_subjects)}
+        if rng.random() < 0.3:
+            payload["binary"] = True
+        if rng.random() < 0.2:
+            payload["trace"] = True
+        return payload
+
+    async def _drain(self, ws):
+        try:
+            async for frame in ws:
+                self.received += 1
+                if isinstance(frame, str) and '"trace"' in frame and self.rng.random() < 0.05:
+                    envelope = json.loads(frame)
+                    now = time.time() * 1000
+                    await ws.send(json.dumps({
+                        "action": "trace_report",
+                        "subject": envelope.get("subject"),
+                        "trace": envelope.get("trace"),
+                        "client_recv": now,
+                        "client_render": now + 1,
+                    }))
+        except Exception:
+            pass
+
+    async def _session(self, ws):
+        rng = self.rng
+        subscribed: set[str] = set()
+        for request_id in range(rng.randint(1, 20)):
+            roll = rng.random()
+            if roll < 0.55 or not subscribed:
+                payload = self._subscribe_payload()
+                subscribed.add(payload["subject"])
+            elif roll < 0.75:
+                subject = rng.choice(sorted(subscribed))
+                subscribed.discard(subject)
+                payload = {"action": "unsubscribe", "subject": subject}
+            elif roll < 0.9:
+                subjects = rng.sample(sorted(subscribed), k=rng.randint(1, len(subscribed)))
+                subscribed.difference_update(subjects)
+                payload = {"action": "unsubscribe_many", "subjects": subjects}
+            elif roll < 0.95:
+                payload = {"action": "bogus"}
+            else:
+                await ws.send("{not json")
+                continue
+
+            if rng.random() < 0.7:
+                payload["id"] = request_id
+            await ws.send(json.dumps(payload))
+            self.actions += 1
+            await asyncio.sleep(rng.random() * 0.2)
+
+    async def client_loop(self, deadline: float):
+        import websockets
+
+        rng = self.rng
+        while time.monotonic() < deadline:
+            try:
+                ws = await websockets.connect(self.url, open_timeout=5, close_timeout=1)
+            except Exception:
+                await asyncio.sleep(0.5)
+                continue
+
+            self.connections += 1
+            drain = asyncio.create_task(self._drain(ws))
+            try:
+                await self._session(ws)
+                await asyncio.sleep(rng.random() * 2.0)
+            except Exception:
+                pass
+            finally:
+                if rng.random() < self.args.abort_rate:
+                    ws.transport.abort()
+                else:
+                    try:
+                        await ws.close()
+                    except Exception:
+                        pass
+                drain.cancel()
+                try:
+                    await drain
+                except asyncio.CancelledError:
+                    pass
+
+            await asyncio.sleep(rng.random() * 0.5)
+
+    async def publisher_loop(self, nc: LocalNats, deadline: float):
+        rng = self.rng
+        subjects = self.plain_subjects + self.heartbeat_subjects
+        interval = 1.0 / self.args.rate if self.args.rate > 0 else None
+        if interval is None:
+            return
+
+        while time.monotonic() < deadline:
+            subject = rng.choice(subjects)
+            kind = rng.random()
+            headers = None
+            if kind < 0.6:
+                payload = json.dumps({"value": rng.random(), "seq": nc.published}).encode()
+                headers = {"Nats-Time-Stamp": str(time.time())}
+            elif kind < 0.8:
+                payload = f"plain text {rng.random()}".encode()
+            else:
+                payload = bytes(rng.getrandbits(8) for _ in range(rng.randint(8, 256))) + b"\xff"
+            await nc.publish(subject, payload, headers=headers)
+            await asyncio.sleep(interval)
+
+
+async def _run_phase(scenario: Scenario, nc: LocalNats, seconds: float):
+    deadline = time.monotonic() + seconds
+    clients = [
+        asyncio.create_task(scenario.client_loop(deadline))
+        for _ in range(scenario.args.clients)
+    ]
+    publisher = asyncio.create_task(scenario.publisher_loop(nc, deadline))
+    await asyncio.gather(publisher, *clients)
+
+
+async def _settle(seconds: float):
+    await asyncio.sleep(seconds)
+    gc.collect()
+
+
+async def _sampler(nats_manager, nc: LocalNats, scenario: Scenario, baseline: dict):
+    # Growth against the baseline snapshot is reported with every sample once
+    # it exists, so a slow leak is visible while a long soak is still running.
+    args = scenario.args
+    while True:
+        await asyncio.sleep(args.sample_interval)
+        snapshot = baseline.get("snapshot")
+        _emit(
+            "sample",
+            rss_mb=round(rss_mb(), 2),
+            traced_mb=round(traced_mb(), 2),
+            connections=scenario.connections,
+            actions=scenario.actions,
+            received=scenario.received,
+            nats_published=nc.published,
+            nats_dropped=nc.dropped,
+            nats_injected_errors=nc.injected_errors,
+            registries=registry_sizes(nats_manager, nc),
+            top_allocation_diffs=(
+                top_allocation_diffs(snapshot, args.top) if snapshot is not None else None
+            ),
+        )
+
+
+async def run(args: argparse.Namespace) -> int:
+    import websockets
+
+    from app.core.config import settings
+    from app.main import on_nats_msg
+    from app.nats.publisher import set_nats_client
+    from app.nats.subscription_manager import NatsSubscriptionManager
+    from app.ws.websocket_handler import websocket_handler
+
+    rng = random.Random(args.seed)
+    nc = LocalNats(rng, args.nats_error_rate)
+    set_nats_client(nc)
+    nats_manager = NatsSubscriptionManager(nc, on_nats_msg)
+
+    server = await websockets.serve(
+        lambda ws: websocket_handler(ws, nats_manager),
+        host="127.0.0.1",
+        port=0,
+        max_queue=32,
+    )
+    port = server.sockets[0].getsockname()[1]
+    scenario = Scenario(args, rng, f"ws://127.0.0.1:{port}", settings.HEARTBEAT_EVENT_NAME)
+    _emit("start", port=port, args=vars(args))
+
+    baseline: dict[str, tracemalloc.Snapshot] = {}
+    sampler = asyncio.create_task(_sampler(nats_manager, nc, scenario, baseline))
+    try:
+        await _run_phase(scenario, nc, args.warmup)
+        await _settle(args.settle)
+        baseline_rss = rss_mb()
+        baseline_traced = traced_mb()
+        baseline_snapshot = baseline["snapshot"] = tracemalloc.take_snapshot()
+        _emit("baseline", rss_mb=round(baseline_rss, 2), traced_mb=round(baseline_traced, 2))
+
+        await _run_phase(scenario, nc, args.duration)
+        await _settle(args.settle)
+    finally:
+        sampler.cancel()
+
+    final_rss = rss_mb()
+    final_traced = traced_mb()
+    registries = registry_sizes(nats_manager, nc)
+    top = top_allocation_diffs(baseline_snapshot, args.top)
+
+    failures = []
+    leaked = {name: size for name, size in registries.items() if size}
+    if leaked:
+        failures.append(f"registries not empty after all clients left: {leaked}")
+    if final_rss - baseline_rss > args.rss_tolerance_mb:
+        failures.append(
+            f"RSS grew {final_rss - baseline_rss:.2f} MB (tolerance {args.rss_tolerance_mb} MB)"
+        )
+    if final_traced - baseline_traced > args.traced_tolerance_mb:
+        failures.append(
+            f"traced memory grew {final_traced - baseline_traced:.2f} MB "
+            f"(tolerance {args.traced_tolerance_mb} MB)"
+        )
+
+    _emit(
+        "result",
+        ok=not failures,
+        failures=failures,
+        rss_mb=round(final_rss, 2),
+        rss_growth_mb=round(final_rss - baseline_rss, 2),
+        traced_mb=round(final_traced, 2),
+        traced_growth_mb=round(final_traced - baseline_traced, 2),
+        registries=registries,
+        top_allocation_diffs=top,
+        connections=scenario.connections,
+        actions=scenario.actions,
+        received=scenario.received,
+        nats_published=nc.published,
+        nats_injected_errors=nc.injected_errors,
+    )
+
+    server.close()
+    await server.wait_closed()
+    await nats_manager.stop_all()
+    return 1 if failures else 0
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+
+    # Settings are read at import time, configure before importing app modules.
+    os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="gateway-soak-"))
+    os.environ["LOG_LEVEL"] = args.log_level
+    os.environ["CLUSTER_ENABLED"] = "false"
+    os.environ["ADMIN_ENABLED"] = "false"
+
+    tracemalloc.start(args.tracemalloc_frames)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())